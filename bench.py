@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""times make_root_files.go() and determine_binning.variable_width() on
+synthetic eventTree files (see fake_trees.py), so that no CMS data are needed
+
+The inputs of each size are written once, below --dir, and reused.  The
+timings are stored in --results, keyed by git commit; each run prints
+them next to those of the other commits.
+
+Usage: bench.py [--sizes=1e6,10e6,50e6] [--mrf-args="--backend=uproot --jobs=4"]"""
+
+import json
+import optparse
+import os
+import shlex
+import subprocess
+import time
+
+import cfg
+import determine_binning
+import make_root_files
+import shapes
+
+
+def commit():
+    """git commit of the tree holding this file, with -dirty if it has local changes"""
+    repo = os.path.dirname(os.path.abspath(__file__))
+    out = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=repo).strip()
+    if subprocess.call(["git", "diff", "--quiet", "HEAD"], cwd=repo):
+        out += "-dirty"
+    return out
+
+
+def sizeLabel(nEntries):
+    for unit, letter in [(1000000, "M"), (1000, "k")]:
+        if nEntries % unit == 0:
+            return "%d%s" % (nEntries // unit, letter)
+    return str(nEntries)
+
+
+def generated(nEntries, variations):
+    """write the inputs (in the current directory), unless already there for the same plan"""
+    stamp = "generated.json"
+    plan = cfg.plan()
+    want = {"nEntries": nEntries, "variations": variations,
+            "plan": dict([(category, plan.categoryKey(category)) for category, _ in plan.categories])}
+    if os.path.exists(stamp) and json.load(open(stamp)) == want:
+        return 0.0
+
+    import fake_trees
+    t0 = time.time()
+    fake_trees.writeAll(nEntries, variations)
+    out = time.time() - t0
+    json.dump(want, open(stamp, "w"))
+    return out
+
+
+def binned(fileName):
+    """determine_binning.variable_width() of every sum_b"""
+    hs = shapes.load(fileName)
+    for path, h in sorted(hs.iteritems()):
+        if path.endswith("/sum_b"):
+            determine_binning.variable_width(h=h, minWidth=h.GetBinWidth(1))
+
+
+def one(nEntries, topDir, mrfArgs, variations):
+    d = os.path.join(topDir, sizeLabel(nEntries))
+    cfg.mkdir(d)
+    cwd = os.getcwd()
+    os.chdir(d)
+    try:
+        # everything written by make_root_files stays below d
+        cfg.root_dest = "shapes"
+        cfg.histoCacheDir = "shapes/.histo_cache"
+        cfg.snapshotDir = "shapes/.snapshots"
+        cfg.partialsDir = "shapes/.partials"
+
+        out = {"entries": nEntries, "generate": generated(nEntries, variations)}
+        make_root_files.options = make_root_files.opts(mrfArgs + ["--no-cache", "--sum-b"])
+
+        var = cfg.variable()
+        t0 = time.time()
+        make_root_files.go(var, skipVariations=not variations)
+        out["go"] = time.time() - t0
+
+        fileName = cfg.outFileName(**var)
+        if make_root_files.options.backend == "uproot":
+            fileName = fileName.replace(".root", ".npz")
+        t0 = time.time()
+        binned(fileName)
+        out["binning"] = time.time() - t0
+    finally:
+        os.chdir(cwd)
+    return out
+
+
+def report(results, sizes):
+    """table of the go() times (s) of each commit, oldest first"""
+    labels = [sizeLabel(n) for n in sizes]
+    header = "%-14s  %-19s  %s" % ("commit", "date", "  ".join(["%9s" % label for label in labels]))
+    print header
+    print "-" * len(header)
+    for c, result in sorted(results.iteritems(), key=lambda x: x[1]["date"]):
+        fields = []
+        for label in labels:
+            run = result["runs"].get(label)
+            fields.append("%9.2f" % run["go"] if run else "%9s" % "-")
+        print "%-14s  %-19s  %s" % (c, result["date"], "  ".join(fields))
+
+
+def opts():
+    parser = optparse.OptionParser(usage=__doc__.split("Usage: ")[1])
+    parser.add_option("--sizes",
+                      dest="sizes",
+                      default="1e6,10e6,50e6",
+                      help="comma-separated numbers of entries per input file")
+
+    parser.add_option("--dir",
+                      dest="dir",
+                      default="bench",
+                      help="directory for the inputs and outputs")
+
+    parser.add_option("--results",
+                      dest="results",
+                      default="bench/results.json",
+                      help="JSON file of the timings of each commit")
+
+    parser.add_option("--mrf-args",
+                      dest="mrfArgs",
+                      default="",
+                      help="options passed to make_root_files.py, e.g. '--backend=uproot --jobs=4'")
+
+    parser.add_option("--variations",
+                      dest="variations",
+                      default=False,
+                      action="store_true",
+                      help="also write and fill the systematic variations")
+
+    options, args = parser.parse_args()
+    return options
+
+
+if __name__ == "__main__":
+    options = opts()
+    sizes = [int(float(x)) for x in options.sizes.split(",")]
+
+    results = {}
+    if os.path.exists(options.results):
+        results = json.load(open(options.results))
+
+    c = commit()
+    result = {"date": time.strftime("%Y-%m-%d %H:%M:%S"), "mrfArgs": options.mrfArgs, "runs": {}}
+    if c in results and results[c]["mrfArgs"] == options.mrfArgs:
+        result["runs"] = results[c]["runs"]  # keep the other sizes
+    for nEntries in sizes:
+        result["runs"][sizeLabel(nEntries)] = one(nEntries, options.dir, shlex.split(options.mrfArgs), options.variations)
+        results[c] = result
+
+        cfg.mkdir(os.path.dirname(options.results) or ".")
+        json.dump(results, open(options.results, "w"), indent=1, sort_keys=True)
+
+    print
+    report(results, sizes)
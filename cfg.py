@@ -1,3 +1,4 @@
+import hashlib
 import os
 import sys
 from root_dest import root_dest
@@ -28,7 +29,19 @@ bdtDir = "root/bdt/11/"
 lumi = 2153.0  # Feb. 29 cards
 # lumi = 2246.26 # 76X
 
+histoCacheDir = "%s/.histo_cache" % root_dest
+histoCacheMaxBytes = 2 * 1024**3
+snapshotDir = "%s/.snapshots" % root_dest
+partialsDir = "%s/.partials" % root_dest  # per-input histograms, for make_root_files.py --append
+
+def inputs(fileNames):
+    """list of the input files of a variation (see files())"""
+    return [fileNames] if type(fileNames) is str else list(fileNames)
+
+
 def files(category=""):
+    # a value may also be a list of files (e.g. successive batches of data), whose
+    # histograms are summed; the rate factors are read from the first one
     if category == "et":
         # stem = "13TeV_zp_feb2/combined_%s_withPUWeight%s.root"  # 1,3 prong
         # stem = "13TeV_zp_feb26/combined_%s_withPUWeight%s.root"  # 1,2,3 prong
@@ -226,6 +239,16 @@ def variable():
     return out
 
 
+def variables():
+    """observables to compare (see make_root_files.py --all-variables)"""
+    out = [variable(),
+           {"var": "m_effective", "bins": range(0, 300, 50) + [300, 400, 600, 800, 1200], "cuts": {}},
+           {"var": "mt_1", "bins": range(0, 200, 20) + [200, 300, 500], "cuts": {}},
+           {"var": "pt_2", "bins": range(0, 200, 20) + [200, 300, 500], "cuts": {}},
+           ]
+    return out
+
+
 def mkdir(path):
     try:
         os.makedirs(path)
@@ -235,8 +258,12 @@ def mkdir(path):
 
 
 def outFileName(sFactor=0, sKey="", var="", cuts={}, tag="", **_):
+    mkdir(root_dest)
+    return _outFileName(sFactor, sKey, var, cuts, tag)
+
+
+def _outFileName(sFactor=0, sKey="", var="", cuts={}, tag=""):
     stem = root_dest + "/"
-    mkdir(stem)
 
     if sFactor:
         print "FIXME: sFactor"
@@ -278,3 +305,111 @@ def checkProcs(d):
     fakeBkgs = list(set(fakeBkgs))
     if fakeBkgs:
         print "FIXME: include", sorted(fakeBkgs)
+
+
+class Plan(object):
+    """what a run reads from this file, compiled once (see plan()) and then
+    frozen: the accessors return copies, and key is a hash of everything
+    (categoryKey() and procsKey() hash only what concerns one category)"""
+
+    __slots__ = ["categories", "masses", "signalMasses", "outputs", "key", "_files", "_procs", "_procs2", "_factorNames", "_categoryKeys"]
+
+    def __init__(self, vars):
+        s = object.__setattr__
+        s(self, "categories", tuple(sorted(categories.iteritems())))
+        s(self, "masses", tuple(masses))
+
+        files_, procs_, procs2_, factorNames, signalMasses = [], [], [], [], []
+        for category, _ in self.categories:
+            fs = files(category)
+            if "" not in fs:
+                sys.exit("ERROR: files('%s') has no nominal entry ('')." % category)
+            files_.append((category, tuple([(variation, tuple(inputs(fs[variation]))) for variation in sorted(fs)])))
+
+            ps = procs(vars[0]["var"], category)  # validated by checkProcs()
+            procs_.append((category, tuple([(destProc, tuple(ps[destProc])) for destProc in sorted(ps)])))
+            ps2 = procs2(vars[0]["var"], category)
+            procs2_.append((category, tuple([(destProc, tuple(ps2[destProc])) for destProc in sorted(ps2)])))
+
+            for destProc in sorted(ps):
+                digits = destProc.lstrip("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ")
+                if isSignal(destProc) and digits.isdigit() and int(digits) in masses:
+                    signalMasses.append((destProc, int(digits)))
+
+            for var in vars:
+                for proc in ["QCD", "WJets"]:
+                    for variation in sorted(fs):
+                        k = (category, proc, variation, _cutsKey(var["cuts"]))
+                        factorNames.append((k, transfer_factor_name(category, proc, variation, cuts=var["cuts"])))
+
+        s(self, "signalMasses", tuple(sorted(set(signalMasses))))
+        s(self, "outputs", tuple([_outFileName(var=var["var"], cuts=var["cuts"]) for var in vars]))
+        s(self, "_files", dict(files_))
+        s(self, "_procs", dict(procs_))
+        s(self, "_procs2", dict(procs2_))
+        s(self, "_factorNames", dict(factorNames))
+        s(self, "key", hashlib.sha1(repr((self.categories, self.masses, self.signalMasses, self.outputs, lumi,
+                                          sorted(files_), sorted(procs_), sorted(procs2_), sorted(factorNames)))).hexdigest())
+        s(self, "_categoryKeys", dict([(category, hashlib.sha1(repr((category, tag, lumi, self._files[category], self._procs[category],
+                                                                      self._procs2[category], self.signalMasses))).hexdigest())
+                                       for category, tag in self.categories]))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Plan is frozen")
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __eq__(self, other):
+        return isinstance(other, Plan) and self.key == other.key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def files(self, category):
+        """{variation: [input file]}"""
+        return dict([(variation, list(fileNames)) for variation, fileNames in self._files[category]])
+
+    def inputs(self, category, skipVariations=False):
+        """every input file of the category (each once), or only the nominal ones"""
+        return sorted(set(sum([list(fileNames) for variation, fileNames in self._files[category]
+                               if not (skipVariations and variation)], [])))
+
+    def categoryKey(self, category):
+        """hash of the files and processes of the category (not of other categories or variables)"""
+        return self._categoryKeys[category]
+
+    def procsKey(self, category):
+        """hash of the processes of the category and lumi: what, besides the file itself,
+        determines an input file's first-layer histograms (not the list of files)"""
+        return hashlib.sha1(repr((category, lumi, self._procs[category], self._procs2[category]))).hexdigest()
+
+    def procs(self, category):
+        """{destProc: [srcProc]} (see procs())"""
+        return dict([(destProc, list(srcProcs)) for destProc, srcProcs in self._procs[category]])
+
+    def procs2(self, category):
+        return dict([(destProc, list(srcProcs)) for destProc, srcProcs in self._procs2[category]])
+
+    def factorName(self, category, proc, variation, cuts):
+        """transfer_factor_name(), for cuts of variables not in the plan as well"""
+        out = self._factorNames.get((category, proc, variation, _cutsKey(cuts)))
+        if out is None:
+            out = transfer_factor_name(category, proc, variation, cuts=cuts)
+        return out
+
+
+_plan = None
+
+
+def plan():
+    """the Plan of variables(), compiled on the first call: edit the settings of
+    this module (e.g. root_dest) before that"""
+    global _plan
+    if _plan is None:
+        _plan = Plan(variables())
+    return _plan
+
+
+def _cutsKey(cuts):
+    return tuple(sorted(cuts.iteritems()))
@@ -13,7 +13,7 @@ print it
 
 histos = ["data_obs"]
 
-for cat in cfg.categories.values():
+for _, cat in cfg.plan().categories:
     print cat
     for hName in histos:
         fIn = r.TFile(br)
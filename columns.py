@@ -0,0 +1,115 @@
+"""columnar reads of TTree expressions into numpy arrays
+
+The expressions are evaluated by TTree::Draw in "goff" mode, a chunk
+of entries at a time, so that only the branches which they use are
+read and no per-entry Python code runs."""
+
+import re
+
+import numpy
+
+
+def asArray(buf, n):
+    if not n:
+        return numpy.zeros(0)
+    buf.SetSize(n)
+    return numpy.frombuffer(buf, dtype=numpy.float64, count=n).copy()
+
+
+def chunks(tree, exprs=[], selection="", chunkSize=1000000, first=0, last=None):
+    """yield ([one array per expression], weights), for each chunk of entries
+
+    Only entries with non-zero selection are included; their weights
+    are the values of the selection.  An expression must not use the
+    ternary operator within the first branch of another one (TTree::Draw
+    would split it at the inner ':')."""
+    assert exprs
+    if last is None:
+        last = tree.GetEntries()
+
+    tree.SetEstimate(1 + chunkSize)
+    varexp = ":".join(exprs)
+    for iEntry in range(first, last, chunkSize):
+        nRows = tree.Draw(varexp, selection, "goff", min(chunkSize, last - iEntry), iEntry)
+        if nRows < 0:
+            raise ValueError("TTree::Draw failed for '%s' with selection '%s'." % (varexp, selection))
+        yield [asArray(tree.GetVal(i), nRows) for i in range(len(exprs))], asArray(tree.GetW(), nRows)
+
+
+def index(expr, values):
+    """expression evaluating to the position in values of the string expression expr (else -1)"""
+    out = "-1"
+    for i, value in reversed(list(enumerate(values))):
+        out = '(%s=="%s") ? %d : (%s)' % (expr, value, i, out)
+    return out
+
+
+def labels(tree, expr="sampleName", selection=""):
+    """distinct values (null padding removed) of the string expression expr"""
+    tree.Draw("%s>>h_labels" % expr, selection, "goff")
+    h = tree.GetHistogram()
+
+    out = set()
+    if h:
+        axis = h.GetXaxis()
+        for iBin in range(1, 1 + axis.GetNbins()):
+            label = axis.GetBinLabel(iBin)
+            if label and h.GetBinContent(iBin):
+                out.add(label.split("\x00")[0])
+        h.Delete()
+    return sorted(out)
+
+
+def identifiers(exprs=[], candidates=[]):
+    """those of the candidate names which appear in the expressions"""
+    candidates = set(candidates)
+
+    out = set()
+    for expr in exprs:
+        expr = re.sub(r'"[^"]*"', '""', expr)  # string literals
+        for token in re.findall(r"[A-Za-z_][A-Za-z0-9_]*", expr):
+            if token in candidates:
+                out.add(token)
+    return sorted(out)
+
+
+def branchesUsed(tree, exprs=[]):
+    """names of the tree's branches appearing in the expressions"""
+    return identifiers(exprs, [b.GetName() for b in tree.GetListOfBranches()])
+
+
+def prune(tree, exprs=[], basketsAhead=10, maxCacheBytes=200 * 1024**2):
+    """enable only the branches used by exprs, with a read-ahead cache sized for them"""
+    used = branchesUsed(tree, exprs)
+
+    tree.SetBranchStatus("*", 0)
+    for name in used:
+        tree.SetBranchStatus(name, 1)
+
+    basketBytes = sum([tree.GetBranch(name).GetBasketSize() for name in used])
+    tree.SetCacheSize(min(maxCacheBytes, basketsAhead * basketBytes))
+    for name in used:
+        tree.AddBranchToCache(name, True)
+    tree.StopCacheLearningPhase()
+    return used
+
+
+def binIndices(x, bins):
+    """TAxis::FindBin of each value (0 is the underflow, n + 1 the overflow)"""
+    if type(bins) is list:
+        return numpy.searchsorted(numpy.asarray(bins, dtype=numpy.float64), x, side="right")
+
+    n, xMin, xMax = bins
+    out = numpy.where(x < xMin, 0, n + 1)
+    inside = (xMin <= x) & (x < xMax)
+    out[inside] = 1 + (n * (x[inside] - xMin) / (xMax - xMin)).astype(numpy.int64)
+    return out
+
+
+def histogram(x, w, bins):
+    """(sum of weights, sum of squared weights) in each bin, including under/overflows"""
+    nBins = len(bins) - 1 if type(bins) is list else bins[0]
+    iBins = binIndices(x, bins)
+    sumw = numpy.bincount(iBins, weights=w, minlength=2 + nBins)
+    sumw2 = numpy.bincount(iBins, weights=w * w, minlength=2 + nBins)
+    return sumw, sumw2
@@ -1,10 +1,11 @@
 #!/usr/bin/env python
 
-import ROOT as r
 import collections
 import os
 import sys
 
+from lazy_root import r  # imported on first use: report() and common_keys() do not need it
+
 
 def fetchOneDir(f, subdir, scale):
     out = {}
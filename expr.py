@@ -0,0 +1,192 @@
+"""TTreeFormula-style expressions (such as make_root_files.weight and
+selection build), parsed once and evaluated on numpy arrays
+
+Supported: numbers, "strings", branch names, + - * / (left-associative,
+so that the results match TTreeFormula's to the last bit), comparisons,
+&& || !, the ternary ?: and the functions below.  Comparing a string
+branch with a literal needs the branch's labels (as stored in a
+snapshot)."""
+
+import re
+
+import numpy
+
+
+functions = {"fabs": numpy.abs,
+             "abs": numpy.abs,
+             "sqrt": numpy.sqrt,
+             "exp": numpy.exp,
+             "log": numpy.log,
+             }
+
+ufuncs = {"||": numpy.logical_or,
+          "&&": numpy.logical_and,
+          "==": numpy.equal,
+          "!=": numpy.not_equal,
+          "<": numpy.less,
+          ">": numpy.greater,
+          "<=": numpy.less_equal,
+          ">=": numpy.greater_equal,
+          "+": numpy.add,
+          "-": numpy.subtract,
+          "*": numpy.multiply,
+          "/": numpy.divide,
+          }
+
+precedence = [["||"], ["&&"], ["==", "!="], ["<", ">", "<=", ">="], ["+", "-"], ["*", "/"]]
+
+_token = re.compile(r'\s*(?:(\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)|"([^"]*)"|([A-Za-z_][A-Za-z0-9_]*)|(&&|\|\||==|!=|<=|>=|[-+*/<>!?:(),]))')
+_compiled = {}
+
+
+def tokens(text):
+    """[(kind, value)] with kind among "num", "str", "name", "op\""""
+    out = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = _token.match(text, pos)
+        if not m:
+            raise ValueError("cannot parse '%s' at '%s'." % (text, text[pos:]))
+        number, string, name, op = m.groups()
+        if number is not None:
+            out.append(("num", float(number)))
+        elif string is not None:
+            out.append(("str", string))
+        elif name is not None:
+            out.append(("name", name))
+        else:
+            out.append(("op", op))
+        pos = m.end()
+    return out
+
+
+class Expr(object):
+    """parsed expression: nodes are tuples (operator, operand, ...)"""
+    __slots__ = ["text", "tree"]
+
+    def __init__(self, text):
+        self.text = text
+        toks = tokens(text)
+        self.tree, pos = _ternary(toks, 0)
+        if pos != len(toks):
+            raise ValueError("cannot parse '%s': unexpected '%s'." % (text, toks[pos][1]))
+
+    def __str__(self):
+        return self.text
+
+    def branches(self):
+        """sorted names of the branches used"""
+        return sorted(_names(self.tree, set()))
+
+    def evaluate(self, cols={}, labels={}, n=None):
+        """values for the entries of the columns {branch: array}; labels are {branch: [string, ...]}
+        for string branches stored as positions; a constant expression gives an array of length n"""
+        out = _evaluate(self.tree, cols, labels)
+        if numpy.ndim(out) == 0:
+            if n is None:
+                n = len(cols.values()[0]) if cols else 1
+            out = numpy.full(n, out, dtype=numpy.float64)
+        return out
+
+
+def compiled(text):
+    """Expr of text (parsed once per text)"""
+    if text not in _compiled:
+        _compiled[text] = Expr(text)
+    return _compiled[text]
+
+
+def _expect(toks, pos, op):
+    if pos == len(toks) or toks[pos] != ("op", op):
+        raise ValueError("expected '%s'." % op)
+    return 1 + pos
+
+
+def _ternary(toks, pos):
+    cond, pos = _binary(toks, pos, 0)
+    if pos < len(toks) and toks[pos] == ("op", "?"):
+        a, pos = _ternary(toks, 1 + pos)
+        pos = _expect(toks, pos, ":")
+        b, pos = _ternary(toks, pos)
+        return ("?", cond, a, b), pos
+    return cond, pos
+
+
+def _binary(toks, pos, level):
+    if level == len(precedence):
+        return _unary(toks, pos)
+
+    left, pos = _binary(toks, pos, 1 + level)
+    while pos < len(toks) and toks[pos][0] == "op" and toks[pos][1] in precedence[level]:
+        op = toks[pos][1]
+        right, pos = _binary(toks, 1 + pos, 1 + level)
+        left = (op, left, right)
+    return left, pos
+
+
+def _unary(toks, pos):
+    if pos < len(toks) and toks[pos] in [("op", "!"), ("op", "-"), ("op", "+")]:
+        operand, end = _unary(toks, 1 + pos)
+        return ("unary" + toks[pos][1], operand), end
+    return _primary(toks, pos)
+
+
+def _primary(toks, pos):
+    if pos == len(toks):
+        raise ValueError("unexpected end of expression.")
+
+    kind, value = toks[pos]
+    if kind == "num":
+        return ("num", value), 1 + pos
+    if kind == "str":
+        return ("str", value), 1 + pos
+    if kind == "name":
+        if pos + 1 < len(toks) and toks[1 + pos] == ("op", "("):
+            if value not in functions:
+                raise ValueError("unknown function '%s'." % value)
+            arg, pos = _ternary(toks, 2 + pos)
+            return ("call", value, arg), _expect(toks, pos, ")")
+        return ("name", value), 1 + pos
+    if (kind, value) == ("op", "("):
+        inner, pos = _ternary(toks, 1 + pos)
+        return inner, _expect(toks, pos, ")")
+    raise ValueError("unexpected '%s'." % value)
+
+
+def _names(node, out):
+    if node[0] == "name":
+        out.add(node[1])
+    else:
+        for child in node[1:]:
+            if type(child) is tuple:
+                _names(child, out)
+    return out
+
+
+def _evaluate(node, cols, labels):
+    op = node[0]
+    if op == "num":
+        return node[1]
+    if op == "name":
+        return cols[node[1]]
+    if op == "str":
+        raise ValueError("string literal \"%s\" outside of a comparison." % node[1])
+    if op == "call":
+        return functions[node[1]](_evaluate(node[2], cols, labels))
+    if op == "?":
+        return numpy.where(_evaluate(node[1], cols, labels), _evaluate(node[2], cols, labels), _evaluate(node[3], cols, labels))
+    if op == "unary!":
+        return numpy.logical_not(_evaluate(node[1], cols, labels))
+    if op == "unary-":
+        return numpy.negative(_evaluate(node[1], cols, labels))
+    if op == "unary+":
+        return _evaluate(node[1], cols, labels)
+
+    left, right = node[1:]
+    if op in ["==", "!="] and "str" in [left[0], right[0]]:
+        (_, name), (_, value) = sorted([left, right], key=lambda x: x[0] == "str")
+        values = labels[name]
+        code = values.index(value) if value in values else -1
+        return ufuncs[op](cols[name], code)
+    return ufuncs[op](_evaluate(left, cols, labels), _evaluate(right, cols, labels))
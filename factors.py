@@ -0,0 +1,98 @@
+"""rate factors (loose-to-tight, MC-to-embedded), stored in the input
+files as histograms whose first bin holds the value and its uncertainty
+
+Each file's factors are read in a single sweep of its keys and kept as
+{name: (value, uncertainty)}.  An overlay file, either .json
+({name: [value, uncertainty]}) or .root, replaces some or all of them
+without touching the input files."""
+
+import json
+import os
+
+import lazy_root
+import rootless
+from lazy_root import r
+
+
+_stores = {}  # (fileName, overlay) --> {name: (value, uncertainty, source)}
+_used = {}  # (name, source) --> (value, uncertainty), for report()
+
+
+def fromRootFile(fileName):
+    if not lazy_root.available():
+        return rootless.factors(fileName)
+
+    f = r.TFile(fileName)
+    if f.IsZombie():
+        raise IOError("could not open '%s'." % fileName)
+
+    out = {}
+    _sweep(f, "", out)
+    f.Close()
+    return out
+
+
+def _sweep(d, prefix, out):
+    for key in d.GetListOfKeys():  # the highest cycle of a name comes first
+        name = prefix + key.GetName()
+        if name in out:
+            continue
+
+        c = r.TClass.GetClass(key.GetClassName())
+        if not c:
+            continue
+        if c.InheritsFrom("TDirectory"):
+            _sweep(key.ReadObj(), name + "/", out)
+        elif c.InheritsFrom("TH1"):
+            h = key.ReadObj()
+            out[name] = (h.GetBinContent(1), h.GetBinError(1))
+            h.Delete()
+
+
+def fromJson(fileName):
+    f = open(fileName)
+    d = json.load(f)
+    f.close()
+    return dict([(str(name), (float(value), float(unc))) for name, (value, unc) in d.iteritems()])
+
+
+def store(fileName, overlay=""):
+    """{name: (value, uncertainty, source)} for fileName, with those of overlay replacing its own"""
+    k = (fileName, overlay)
+    if k not in _stores:
+        out = {}
+        for source in [fileName, overlay]:
+            if not source:
+                continue
+            d = fromJson(source) if source.endswith(".json") else fromRootFile(source)
+            for name, (value, unc) in d.iteritems():
+                out[name] = (value, unc, os.path.basename(source))
+        _stores[k] = out
+    return _stores[k]
+
+
+def get(fileName, name, overlay=""):
+    """(value, uncertainty) of the factor name (None if absent)"""
+    d = store(fileName, overlay)
+    if name not in d:
+        return None
+
+    value, unc, source = d[name]
+    _used[(name, source)] = (value, unc)
+    return value, unc
+
+
+def report(title=""):
+    """print the factors used since the previous report"""
+    if not _used:
+        return
+
+    n = max([len(name) for name, _ in _used.keys()])
+    header = "  ".join([title.ljust(n), "%10s" % "value", "%10s" % "unc", "%10s" % "unc/value", "source"])
+    print header
+    print "-" * len(header)
+    for (name, source), (value, unc) in sorted(_used.iteritems()):
+        rel = ("%10.6f" % (unc / value)) if value else "%10s" % "-"
+        print "  ".join([name.ljust(n), "%10.6f" % value, "%10.6f" % unc, rel, source])
+    print
+    _used.clear()
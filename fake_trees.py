@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""synthetic eventTree files, for benchmarks (see bench.py)
+
+The files are written at the (relative) input paths of cfg.plan(), below
+the current directory.  They hold the branches read by make_root_files
+(weights, Category, the variables of cfg.variables() and the usual cut
+variables), with every sample of the plan's procs in a contiguous range of
+entries, and the rate-factor histograms which applyFactors() reads.
+
+Usage: fake_trees.py N_ENTRIES [--variations]"""
+
+import os
+import sys
+
+import cfg
+from lazy_root import r
+
+
+_nWritten = 0
+
+
+def samples(category):
+    """sorted names of the samples of the plan's procs, and {name: mass} of the signals"""
+    plan = cfg.plan()
+    signalMasses = dict(plan.signalMasses)
+    names = set()
+    masses = {}
+    for destProc, srcProcs in plan.procs(category).iteritems():
+        for proc in srcProcs:
+            names.add(proc.lstrip("-*"))
+            if destProc in signalMasses:
+                masses[proc] = float(signalMasses[destProc])
+    return sorted(names), masses
+
+
+def mVisExpr(names, masses):
+    """C++ expression for m_vis: signals peak below their mass, backgrounds fall exponentially"""
+    out = "gRandom->Exp(60.0 + 20.0 * (hlim_iSample % 4))"
+    for i, name in enumerate(names):
+        if name in masses:
+            m = masses[name]
+            out = "(hlim_iSample == %d) ? fabs(gRandom->Gaus(%g, %g)) : (%s)" % (i, 0.7 * m, 0.1 * m, out)
+    return out
+
+
+def write(fileName, nEntries, category, seed=1):
+    global _nWritten
+    _nWritten += 1
+    names, masses = samples(category)
+    nNames = len(names)
+
+    cfg.mkdir(os.path.dirname(fileName) or ".")
+    r.gRandom.SetSeed(seed)
+    if r.ROOT.IsImplicitMTEnabled():
+        r.ROOT.DisableImplicitMT()  # e.g. enabled by make_root_files.filledRdf()
+
+    # one cross section per sample
+    r.gInterpreter.Declare("std::vector<std::string> hlim_names%d = {%s};" % (_nWritten, ", ".join(['"%s"' % name for name in names])))
+    r.gInterpreter.Declare("std::vector<double> hlim_xs%d = {%s};" % (_nWritten, ", ".join(["%g" % (1.0 if cfg.isData(name) else 0.1 * (1 + i)) for i, name in enumerate(names)])))
+
+    df = r.RDataFrame(nEntries)  # single-threaded: entries stay in order, so samples are contiguous
+    df = df.Define("hlim_iSample", "(int)((long long)rdfentry_ * %d / %d)" % (nNames, nEntries))
+    df = df.Define("sampleName", "hlim_names%d[hlim_iSample]" % _nWritten)
+    df = df.Define("Category", 'std::string("%s")' % category)
+    df = df.Define("xs", "hlim_xs%d[hlim_iSample]" % _nWritten)
+    df = df.Define("initEvents", "(double)%d" % max(1, nEntries // nNames))
+    df = df.Define("initSumWeights", "initEvents")
+    df = df.Define("genEventWeight", "gRandom->Rndm() < 0.1 ? -1.0 : 1.0")
+    df = df.Define("triggerEff", "0.9 + 0.1 * gRandom->Rndm()")
+    df = df.Define("PUWeight", "fabs(gRandom->Gaus(1.0, 0.2))")
+    df = df.Define("embeddedWeight", "fabs(gRandom->Gaus(1.0, 0.1))")
+    df = df.Define("decayModeWeight", "fabs(gRandom->Gaus(1.0, 0.05))")
+    df = df.Define("m_vis", mVisExpr(names, masses))
+    df = df.Define("m_effective", "m_vis + gRandom->Exp(50.0)")
+    df = df.Define("mt_1", "gRandom->Exp(60.0)")
+    df = df.Define("pt_2", "20.0 + gRandom->Exp(40.0)")
+    df = df.Define("pfMEt", "gRandom->Exp(50.0)")
+    df = df.Define("tauDecayMode", "(double)(gRandom->Rndm() < 0.7 ? 0 : (gRandom->Rndm() < 0.8 ? 1 : 10))")
+
+    branches = ["sampleName", "Category", "xs", "initEvents", "initSumWeights", "genEventWeight", "triggerEff", "PUWeight",
+                "embeddedWeight", "decayModeWeight", "m_vis", "m_effective", "mt_1", "pt_2", "pfMEt", "tauDecayMode"]
+    v = r.std.vector("string")()
+    for branch in branches:
+        v.push_back(branch)
+    df.Snapshot("eventTree", fileName, v)
+
+    # the factors read by applyFactors()
+    f = r.TFile(fileName, "UPDATE")
+    for hName, value in [(cfg.plan().factorName(category, "QCD", "", cuts={}), 0.3),
+                         (cfg.plan().factorName(category, "WJets", "", cuts={}), 0.5),
+                         ("MC2Embed2Cat_%s" % category, 1.0),
+                         ]:
+        h = r.TH1D(hName, "", 1, 0.0, 1.0)
+        h.SetBinContent(1, value)
+        h.SetBinError(1, 0.1 * value)
+        h.Write()
+    f.Close()
+
+
+def writeAll(nEntries, variations=False):
+    """write the files of every category (only the nominal ones, unless variations)"""
+    for iCategory, (category, _) in enumerate(cfg.plan().categories):
+        for iVariation, (variation, fileNames) in enumerate(sorted(cfg.plan().files(category).iteritems())):
+            if variation and not variations:
+                continue
+            for fileName in fileNames:
+                print "writing %s (%d entries)" % (fileName, nEntries)
+                write(fileName, nEntries, category, seed=1 + 100 * iCategory + iVariation)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in [2, 3] or (len(sys.argv) == 3 and sys.argv[2] != "--variations"):
+        sys.exit(__doc__.split("Usage: ")[1])
+    writeAll(int(float(sys.argv[1])), variations=(len(sys.argv) == 3))
@@ -0,0 +1,224 @@
+"""array-backed 1D histograms
+
+make_root_files merges, scales and flips many small histograms; Hist
+keeps the sums of weights (sumw) and of squared weights (sumw2) of the
+bins, under- and overflows included, in numpy arrays.  The arithmetic
+matches that of TH1D (Add, Scale, Integral, ...).  Conversion to and
+from TH1D happens only when reading or writing ROOT files."""
+
+import array
+
+import numpy
+
+import columns
+
+
+def edges(bins):
+    """low edges of the bins, plus the upper edge of the last one (as TAxis computes them)"""
+    if type(bins) is list:
+        return [float(x) for x in bins]
+    n, xMin, xMax = bins
+    return [xMin + i * ((xMax - xMin) / float(n)) for i in range(1 + n)]
+
+
+class Hist(object):
+    __slots__ = ["name", "title", "bins", "sumw", "sumw2", "zTitle"]
+
+    def __init__(self, name="", title="", bins=(1, 0.0, 1.0), sumw=None, sumw2=None, zTitle=""):
+        """bins are either a tuple (n, xMin, xMax) or a list of bin edges"""
+        self.name = name
+        self.title = title  # as for TH1: "title;x title;y title"
+        self.bins = bins
+        n = len(bins) - 1 if type(bins) is list else bins[0]
+        self.sumw = numpy.zeros(2 + n) if sumw is None else numpy.array(sumw, dtype=numpy.float64)
+        self.sumw2 = numpy.zeros(2 + n) if sumw2 is None else numpy.array(sumw2, dtype=numpy.float64)
+        self.zTitle = zTitle
+
+    def __getstate__(self):
+        return [getattr(self, slot) for slot in self.__slots__]
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+
+    def nBins(self):
+        return len(self.sumw) - 2
+
+    def xTitle(self):
+        fields = self.title.split(";")
+        return fields[1] if 1 < len(fields) else ""
+
+    def setTitle(self, title):
+        """as TH1::SetTitle: axis titles are changed only if given (after ';')"""
+        fields = self.title.split(";")
+        new = title.split(";")
+        self.title = ";".join(new + fields[len(new):])
+
+    def copy(self, name=None):
+        return Hist(self.name if name is None else name, self.title, self.bins, self.sumw, self.sumw2, self.zTitle)
+
+    def empty(self, name=None):
+        """copy with zeroed contents (Clone + Reset)"""
+        out = self.copy(name)
+        out.sumw[:] = 0.0
+        out.sumw2[:] = 0.0
+        return out
+
+    def add(self, other, factor=1.0):
+        assert len(self.sumw) == len(other.sumw), (self.name, other.name)
+        self.sumw += factor * other.sumw
+        self.sumw2 += (factor * factor) * other.sumw2
+
+    def scale(self, factor):
+        self.sumw *= factor
+        self.sumw2 *= factor * factor
+
+    def integral(self, first=1, last=None):
+        """sum of the contents of bins first..last (inclusive; 0 and n + 1 are the under/overflows)"""
+        last = self.nBins() if last is None else min(last, 1 + self.nBins())
+        return sum(self.sumw[max(0, first):1 + last].tolist())  # sequential, as TH1::Integral
+
+    def content(self, iBin):
+        return self.sumw[iBin]
+
+    def error(self, iBin):
+        return self.sumw2[iBin] ** 0.5
+
+    def lowEdge(self, iBin):
+        e = edges(self.bins)
+        if type(self.bins) is list and 1 <= iBin <= self.nBins():
+            return e[iBin - 1]
+        return e[0] + (iBin - 1) * ((e[-1] - e[0]) / float(self.nBins()))  # as TAxis
+
+    def width(self, iBin):
+        e = edges(self.bins)
+        return e[iBin] - e[iBin - 1]
+
+    def flip(self, zero=True, trackerName=""):
+        """set negative visible bins to zero (or to minus themselves), with error max(|c|, e);
+        return (histogram with 1 in each modified bin (None if none was), sum of the negative contents)"""
+        c = self.sumw[1:-1]
+        negative = c < 0.0
+        if not negative.any():
+            return None, 0.0
+
+        iBins = 1 + numpy.flatnonzero(negative)
+        cNeg = c[negative]
+        e2 = numpy.maximum(-cNeg, self.sumw2[iBins] ** 0.5)
+        self.sumw[iBins] = 0.0 if zero else -cNeg
+        self.sumw2[iBins] = e2 * e2
+
+        tracker = self.empty(trackerName)
+        tracker.sumw[iBins] = 1.0
+        return tracker, cNeg.sum()
+
+    def floor(self):
+        """round the contents of the visible bins down, with errors sqrt(max(0, content))"""
+        c = numpy.floor(self.sumw[1:-1])
+        self.sumw[1:-1] = c
+        self.sumw2[1:-1] = numpy.maximum(0.0, c)
+
+    def shift(self):
+        """move under- and overflows into the first and last visible bins"""
+        for keep, kill in [(self.nBins(), 1 + self.nBins()), (1, 0)]:
+            e = (self.error(keep)**2 + self.error(kill)**2)**0.5
+            self.sumw[keep] += self.sumw[kill]
+            self.sumw[kill] = 0.0
+            self.sumw2[keep] = e * e
+            self.sumw2[kill] = 0.0
+
+    def rebinned(self, newEdges):
+        """copy with bins (including under/overflows) merged into those delimited by
+        newEdges, each of which must be an edge of this histogram"""
+        e = numpy.array(edges(self.bins))
+        centers = numpy.concatenate([[-numpy.inf], (e[:-1] + e[1:]) / 2.0, [numpy.inf]])
+        iBins = numpy.searchsorted(numpy.array(newEdges, dtype=numpy.float64), centers, side="right")
+        n = 2 + len(newEdges) - 1
+        return Hist(self.name, self.title, list(newEdges),
+                    numpy.bincount(iBins, weights=self.sumw, minlength=n),
+                    numpy.bincount(iBins, weights=self.sumw2, minlength=n),
+                    self.zTitle)
+
+    # read-only TH1 interface, so that code written for TH1 (look_sb, determine_binning) also takes Hist
+    def GetName(self):
+        return self.name
+
+    def GetNbinsX(self):
+        return self.nBins()
+
+    def GetBinContent(self, iBin):
+        return self.content(iBin)
+
+    def GetBinError(self, iBin):
+        return self.error(iBin)
+
+    def GetBinLowEdge(self, iBin):
+        return self.lowEdge(iBin)
+
+    def GetBinWidth(self, iBin):
+        return self.width(iBin)
+
+    def FindBin(self, x):
+        return int(columns.binIndices(numpy.array([float(x)]), self.bins)[0])
+
+    def Integral(self, first=1, last=None):
+        return self.integral(first, last)
+
+    def GetXaxis(self):
+        return Axis(self)
+
+    def toTH1(self):
+        from lazy_root import r
+        bins = self.bins
+        if type(bins) is list:
+            bins = (len(bins) - 1, array.array('d', bins))
+
+        h = r.TH1D(self.name, self.title, *bins)
+        h.SetDirectory(0)
+        h.Sumw2()
+        hSumw2 = h.GetSumw2()
+        for iBin in range(len(self.sumw)):
+            h.SetBinContent(iBin, self.sumw[iBin])
+            hSumw2.SetAt(self.sumw2[iBin], iBin)
+        h.ResetStats()
+        if self.zTitle:
+            h.GetZaxis().SetTitle(self.zTitle)
+        return h
+
+
+class Axis(object):
+    __slots__ = ["h"]
+
+    def __init__(self, h):
+        self.h = h
+
+    def GetNbins(self):
+        return self.h.nBins()
+
+    def GetXmin(self):
+        bins = self.h.bins
+        return bins[0] if type(bins) is list else bins[1]
+
+    def GetXmax(self):
+        bins = self.h.bins
+        return bins[-1] if type(bins) is list else bins[2]
+
+    def GetTitle(self):
+        return self.h.xTitle()
+
+
+def fromTH1(h):
+    axis = h.GetXaxis()
+    n = axis.GetNbins()
+    if axis.GetXbins().GetSize():
+        bins = [axis.GetBinLowEdge(iBin) for iBin in range(1, 2 + n)]
+    else:
+        bins = (n, axis.GetXmin(), axis.GetXmax())
+
+    if not h.GetSumw2N():
+        h.Sumw2()
+    sumw2 = h.GetSumw2()
+    return Hist(h.GetName(), "%s;%s;%s" % (h.GetTitle(), axis.GetTitle(), h.GetYaxis().GetTitle()), bins,
+                [h.GetBinContent(iBin) for iBin in range(2 + n)],
+                [sumw2.At(iBin) for iBin in range(2 + n)],
+                h.GetZaxis().GetTitle())
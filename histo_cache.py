@@ -0,0 +1,83 @@
+"""on-disk cache of filled histograms, with size-bounded LRU eviction
+
+Entries are pickled objects stored as <cacheDir>/<key>.pkl; the key is
+a hash of everything which determines the contents (see key()).  A hit
+refreshes the entry's mtime, and store() removes the least recently
+used entries once the directory exceeds its size limit."""
+
+import cPickle
+import hashlib
+import os
+
+
+def fileStamp(fileName):
+    st = os.stat(fileName)
+    return (os.path.abspath(fileName), st.st_size, st.st_mtime)
+
+
+def key(*args):
+    return hashlib.sha1(repr(args)).hexdigest()
+
+
+def path(cacheDir, k):
+    return os.path.join(cacheDir, "%s.pkl" % k)
+
+
+def load(cacheDir, k):
+    p = path(cacheDir, k)
+    try:
+        f = open(p, "rb")
+    except IOError:
+        return None
+
+    try:
+        out = cPickle.load(f)
+    except Exception as e:
+        print "WARNING: ignoring unreadable cache entry %s (%s)" % (p, e)
+        return None
+    finally:
+        f.close()
+
+    os.utime(p, None)  # most recently used
+    return out
+
+
+def store(cacheDir, k, obj, maxBytes=None):
+    try:
+        os.makedirs(cacheDir)
+    except OSError as e:
+        if e.errno != 17:
+            raise e
+
+    p = path(cacheDir, k)
+    tmp = "%s.%d.tmp" % (p, os.getpid())
+    f = open(tmp, "wb")
+    cPickle.dump(obj, f, cPickle.HIGHEST_PROTOCOL)
+    f.close()
+    os.rename(tmp, p)  # atomic, so concurrent workers never see partial entries
+
+    if maxBytes is not None:
+        evict(cacheDir, maxBytes)
+
+
+def evict(cacheDir, maxBytes):
+    entries = []
+    for name in os.listdir(cacheDir):
+        if not name.endswith(".pkl"):
+            continue
+        p = os.path.join(cacheDir, name)
+        try:
+            st = os.stat(p)
+        except OSError:  # removed by another process
+            continue
+        entries.append((st.st_mtime, st.st_size, p))
+
+    total = sum([size for _, size, _ in entries])
+    for _, size, p in sorted(entries):
+        if total <= maxBytes:
+            break
+        try:
+            os.remove(p)
+        except OSError:
+            pass
+        total -= size
@@ -0,0 +1,60 @@
+"""ROOT, imported on first use
+
+    from lazy_root import r
+
+r stands for the ROOT module, but importing it costs nothing: ROOT is
+imported (in batch mode, ignoring the command line) when one of its
+attributes is first used, so that tools which never touch a histogram
+or a canvas start without it."""
+
+import imp
+
+
+_module = []  # ROOT, once imported
+_atLoad = []
+
+
+class _Lazy(object):
+    def __getattr__(self, name):
+        return getattr(load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(load(), name, value)
+
+
+r = _Lazy()
+
+
+def load():
+    """the ROOT module (raises ImportError if it is not installed)"""
+    if not _module:
+        import ROOT
+        ROOT.PyConfig.IgnoreCommandLineOptions = True
+        ROOT.gROOT.SetBatch(True)
+        _module.append(ROOT)
+        for func in _atLoad:
+            func(ROOT)
+    return _module[0]
+
+
+def loaded():
+    return bool(_module)
+
+
+def available():
+    """whether ROOT can be imported (without importing it)"""
+    if _module:
+        return True
+    try:
+        imp.find_module("ROOT")
+    except ImportError:
+        return False
+    return True
+
+
+def atLoad(func):
+    """call func(ROOT) once ROOT is imported (or now, if it is)"""
+    if _module:
+        func(_module[0])
+    else:
+        _atLoad.append(func)
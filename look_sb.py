@@ -4,20 +4,35 @@ import os
 import sys
 import math
 import cfg
-import ROOT as r
+import shapes
+
+
+def best_bin(hs, hb):
+    """(bin, s/sqrt(b)) of the bin with largest s/sqrt(b); (None, -999.9) if no bin has b > 0"""
+    xMax = -999.9
+    i = None
+    for iBin in range(1, 1 + hs.GetNbinsX()):
+        s = hs.GetBinContent(iBin)
+        b = hb.GetBinContent(iBin)
+        if 0.0 < b:
+            x = s / math.sqrt(b)
+            if xMax < x:
+                xMax = x
+                i = iBin
+                # print "%3d  %g  %g  %g  %g" % (i, s, b, math.sqrt(b), s / math.sqrt(b))
+    return i, xMax
 
 
 if __name__ == "__main__":
-    fIn = r.TFile(sys.argv[1])
+    hs = shapes.load(sys.argv[1])  # .root or .npz
+    subdirs = sorted([path[:-len("/sum_b")] for path in hs.keys() if path.endswith("/sum_b")])
 
-    for key in fIn.GetListOfKeys():
-        subdir = key.GetName()
-        fIn.cd(subdir)
-        hb = fIn.Get("%s/sum_b" % subdir)
+    for subdir in subdirs:
+        hb = hs["%s/sum_b" % subdir]
         signals = []
-        for key2 in r.gDirectory.GetListOfKeys():
-            hName = key2.GetName()
-            if cfg.isSignal(hName) and not cfg.isVariation(hName):
+        for path in hs.keys():
+            hName = path.split("/")[-1]
+            if path == "%s/%s" % (subdir, hName) and cfg.isSignal(hName) and not cfg.isVariation(hName):
                 signals.append(hName)
 
         print subdir
@@ -25,17 +40,5 @@ if __name__ == "__main__":
         print header
         print "-" * len(header)
         for signal in sorted(signals):
-            hs = fIn.Get("%s/%s" % (subdir, signal))
-            xMax = -999.9
-            i = None
-            for iBin in range(1, 1 + hs.GetNbinsX()):
-                s = hs.GetBinContent(iBin)
-                b = hb.GetBinContent(iBin)
-                if 0.0 < b:
-                    x = s / math.sqrt(b)
-                    if xMax < x:
-                        xMax = x
-                        i = iBin
-                        # print "%3d  %g  %g  %g  %g" % (i, s, b, math.sqrt(b), s / math.sqrt(b))
+            i, xMax = best_bin(hs["%s/%s" % (subdir, signal)], hb)
             print "%10s  %3d  %g     %g" % (signal, i, xMax, 2.0 / xMax)
-    fIn.Close()
@@ -1,19 +1,39 @@
 #!/usr/bin/env python
 
 import array
+import bisect
 import collections
+import itertools
 import math
+import multiprocessing
 import optparse
 import os
+import re
 import sys
 
 import cfg
+import columns
 import compareDataCards
+import expr
+import factors
+import hist
+import histo_cache
+import lazy_root
+import look_sb
+import rootless
+import sample_index
+import shapes
+import snapshot
+import stages
 
-import ROOT as r
-r.PyConfig.IgnoreCommandLineOptions = True
-r.gROOT.SetBatch(True)
-r.gErrorIgnoreLevel = 2000
+import numpy
+from lazy_root import r  # imported on first use; without ROOT, only --backend=uproot (and --use-snapshots) work
+lazy_root.atLoad(lambda ROOT: setattr(ROOT, "gErrorIgnoreLevel", 2000))
+
+
+blockEntries = 1000000  # entries per partial histogram with --chunk-jobs (fixed, for reproducibility)
+_filled = {}  # latest fill of each input file, kept for rebinning: fileName --> {group: (bins, {proc: h})}
+cacheFormat = "Hist"  # part of the cache keys: bump when the type of the cached histograms changes
 
 
 def error(msg="", die=True):
@@ -25,26 +45,13 @@ def error(msg="", die=True):
         print s
 
 
-def combineBinContentAndError(h, binToContainCombo, binToBeKilled):
-    c = h.GetBinContent(binToContainCombo) + h.GetBinContent(binToBeKilled)
-    e = h.GetBinError(binToContainCombo)**2 + h.GetBinError(binToBeKilled)**2
-    e = e**0.5
-
-    h.SetBinContent(binToBeKilled, 0.0)
-    h.SetBinContent(binToContainCombo, c)
-
-    h.SetBinError(binToBeKilled, 0.0)
-    h.SetBinError(binToContainCombo, e)
+def needRoot(what):
+    if not lazy_root.available():
+        error("%s needs ROOT, which could not be imported." % what)
 
 
-def shift(h):
-    n = h.GetNbinsX()
-    combineBinContentAndError(h, n, n+1)  # overflows
-    combineBinContentAndError(h, 1, 0)  # underflows
-
-
-def merge_second_layer(d, f, variable, category, variation):
-    for destProc, srcProcs in cfg.procs2(variable, category).iteritems():
+def merge_second_layer(d, fileName, variable, category, variation):
+    for destProc, srcProcs in cfg.plan().procs2(category).iteritems():
         destProc += variation
 
         for srcProc in srcProcs:
@@ -52,16 +59,14 @@ def merge_second_layer(d, f, variable, category, variation):
             h = d[key]
 
             if destProc not in d:
-                d[destProc] = h.Clone(destProc)
-                d[destProc].SetDirectory(0)
-                d[destProc].Reset()
+                d[destProc] = h.empty(destProc)
 
             if srcProc[0] == "*" and category != '0M':
-                applyFactor(h, f, hName="%s_%s" % (srcProc[1:], category), unit=True)
+                applyFactor(h, fileName, hName="%s_%s" % (srcProc[1:], category), unit=True)
                 if variation:
                     print "FIXME: check varied factors"
 
-            d[destProc].Add(h)
+            d[destProc].add(h)
             del d[key]
 
 
@@ -80,135 +85,847 @@ def rescaled_bins(bins, variable):
 
 def flipped_negative_bins(d, zero=True):
     out = {}
+    rows = []
     for name, h in sorted(d.iteritems()):
-        flipped = h.Clone(name + cfg.flipped_suffix)
-        flipped.Reset()
-
-        for iBin in range(1, 1 + h.GetNbinsX()):
-            c = h.GetBinContent(iBin)
-            e = h.GetBinError(iBin)
-            if c < 0.0:
-                c2 = 0.0 if zero else -c
-                e2 = max([-c, e])
-                h.SetBinContent(iBin, c2)
-                h.SetBinError(iBin, e2)
-                flipped.SetBinContent(iBin, 1)
-                print "%s %s %3d (%4.1e +- %4.1e)  -->  (%4.1e +- %4.1e)" % ("zeroed" if zero else "flipped", name, iBin, c, e, c2, e2)
+        tracker, removed = h.flip(zero, trackerName=name + cfg.flipped_suffix)
         out[name] = h
-        if flipped.Integral():
-            out[flipped.GetName()] = flipped
+        if tracker is not None:
+            out[tracker.name] = tracker
+            rows.append((name, int(tracker.integral()), removed, h.integral(0, 1 + h.nBins())))
+
+    if options.flipSummary and rows:
+        printFlipSummary(rows, "zeroed" if zero else "flipped")
+    return out
+
+
+def printFlipSummary(rows, verb):
+    n = max([len(name) for name, _, _, _ in rows])
+    header = "  ".join(["histogram".ljust(n), "bins %s" % verb, "%12s" % "sum(c < 0)", "%12s" % "integral"])
+    print header
+    print "-" * len(header)
+    for name, nBins, removed, integral in rows:
+        print "  ".join([name.ljust(n), ("%d" % nBins).rjust(len(verb) + 5), "%12.4e" % removed, "%12.4e" % integral])
+    print
+
+
+def mapped(func, args, nJobs=1):
+    """yield func(arg) for each arg, in order, using a pool of nJobs worker processes when possible"""
+    nJobs = min(nJobs, len(args))
+    if nJobs <= 1 or multiprocessing.current_process().daemon:  # daemons may not have children
+        for arg in args:
+            yield func(arg)
+        return
+
+    pool = multiprocessing.Pool(nJobs)
+    try:
+        for result, recs, counts, exitMsg in pool.imap(Task(func), args):
+            stages.add(recs, counts)
+            if exitMsg is not None:
+                pool.terminate()
+                sys.exit(exitMsg)
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+class Task(object):
+    """func(arg) in a worker process, with the stages recorded meanwhile (see
+    stages.py) and the message of a SystemExit (e.g. from error()), which would
+    otherwise kill the worker and leave the pool waiting for it forever"""
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, arg):
+        first = len(stages.records)
+        entries0, bytes0 = stages.counted()
+        try:
+            out = self.func(arg)
+            exitMsg = None
+        except SystemExit as e:
+            out = None
+            exitMsg = e.code if e.code is not None else 1
+        entries1, bytes1 = stages.counted()
+        return out, stages.taken(first), (entries1 - entries0, bytes1 - bytes0), exitMsg
+
+
+def bytesRead():
+    return r.TFile.GetFileBytesRead() if lazy_root.loaded() else 0
+
+
+def histosOneVariation(args):
+    """first layer of merging for one input file (runs in a worker process when --jobs > 1)
+
+    specs is a list of (bins, variable, cuts); one dict is returned for each"""
+    fileName, variation, specs, category = args
+    procs = cfg.plan().procs(category)
+
+    active = [(destProc, srcProcs) for destProc, srcProcs in sorted(procs.iteritems())
+              if options.unblind or destProc != "data_obs"]
+    srcProcs = sum([srcProcs for _, srcProcs in active], [])
+
+    snap = None
+    if options.useSnapshots:
+        snap = snapshot.load(cfg.snapshotDir, fileName)
+        if snap is None or not all([snapshotCovers(snap, stripped(srcProcs), variable, cuts, category) for _, variable, cuts in specs]):
+            print "WARNING: no usable snapshot of %s; reading the .root file" % fileName
+            snap = None
+
+    if snap is None and options.backend == "uproot":
+        f = None
+        tree = rootless.tree(fileName)
+        index = rootless.sampleIndex(fileName, tree)
+    elif snap is None:
+        f = r.TFile(fileName)
+        if f.IsZombie():
+            error(msg="(see above)", die=True)
+
+        tree = f.Get("eventTree")
+        exprs = sum([[variable, selection(category, cuts)] for _, variable, cuts in specs], [])
+        columns.prune(tree, exprs + [sampleWeight(stripped(srcProcs))] + sample_index.exprs)
+        index = sample_index.get(fileName, tree)
+    else:
+        f = tree = None
+        index = snap["samples"]
+
+    labels = {"file": os.path.basename(fileName), "category": category, "variation": variation}
+    with stages.stage("checkSamples", **labels):
+        checkSamples(index, fileName, specs[0][1], category)
+
+    # fill every source process (and every spec) in one pass
+    with stages.stage("fill", **labels):
+        nBytes = bytesRead()
+        outs = [firstLayer(hs, active, variation) for hs in histosOneFile(fileName, tree, specs, srcProcs, category, index, snap)]
+        stages.count(nBytes=bytesRead() - nBytes)
+
+    if f:
+        f.Close()
+    return outs
+
+
+def firstLayer(hs, active, variation):
+    """{destProc + variation: sum of its source processes}"""
+    out = {}
+    for destProc, srcProcs in active:
+        destProc += variation
+
+        for srcProc in srcProcs:
+            h = hs[srcProc]
+            if destProc not in out:
+                out[destProc] = h.empty(destProc)
+            factor = -1.0 if srcProc[0] == "-" else 1.0
+            out[destProc].add(h, factor)
     return out
 
 
+def applyFactors(out, fileName, procs, variable, cuts, category, variation):
+    """loose-to-tight and embedded factors, and second layer of merging"""
+    plan = cfg.plan()
+    applyFactor(out["QCD" + variation], fileName, hName=plan.factorName(category, "QCD", variation, cuts), unit=False)
+    applyFactor(out["W" + variation], fileName, hName=plan.factorName(category, "WJets", variation, cuts), unit=False)
+
+    if any(["embed" in src for src in procs.get("ZTT", [])]):
+        print "WARNING: modifying ZTT"
+        applyFactor(out["ZTT" + variation], fileName, hName="MC2Embed2Cat_%s" % category, unit=(category != '0M'))
+
+    merge_second_layer(out, fileName, variable, category, variation)
+
+
 def histos(bins=None, variable="", cuts={}, category="", skipVariations=False, flipNegativeBins=False):
-    assert bins
+    return histosMany([(bins, variable, cuts)], category, skipVariations, flipNegativeBins)[0]
+
+
+def histosMany(specs=[], category="", skipVariations=False, flipNegativeBins=False):
+    """histos() for each of several (bins, variable, cuts), reading each file once"""
+    assert specs
+    for bins, _, _ in specs:
+        assert bins
 
     # rescale so that bin width is 1.0
     if cfg.rescaleX:
-        bins, variable = rescaled_bins(bins, variable)
+        specs = [rescaled_bins(bins, variable) + (cuts,) for bins, variable, cuts in specs]
 
-    procs = cfg.procs(variable, category)
+    procs = cfg.plan().procs(category)
 
-    out = {}
-    for variation, fileName in cfg.files(category).iteritems():
+    variations = []
+    partials = {}  # (variation, fileName) --> [{destProc: h}], one dict per spec
+    todo = []
+    for variation, fileNames in sorted(cfg.plan().files(category).iteritems()):
         if skipVariations and variation:
             continue
+        variations.append((variation, fileNames))
+        for fileName in fileNames:
+            ds = loadPartial(fileName, variation, specs, category) if options.append else None
+            if ds is None:
+                todo.append((fileName, variation, specs, category))
+            else:
+                partials[(variation, fileName)] = ds
+
+    if options.append:
+        print "%s: filling %d of %d input files" % (category, len(todo), len(todo) + len(partials))
+
+    for args, ds in itertools.izip(todo, mapped(histosOneVariation, todo, options.jobs)):
+        fileName, variation = args[:2]
+        if options.append:
+            storePartial(fileName, variation, specs, category, ds)
+        partials[(variation, fileName)] = ds
+
+    outs = [{} for _ in specs]
+    for variation, fileNames in variations:
+        for (_, variable, cuts), out, d in zip(specs, outs, summed([partials.pop((variation, name)) for name in fileNames])):
+            out.update(d)
+            with stages.stage("applyFactors", category=category, variation=variation):
+                applyFactors(out, fileNames[0], procs, variable, cuts, category, variation)
 
-        f = r.TFile(fileName)
-        if f.IsZombie():
-            error(msg="(see above)", die=True)
+    if options.factors:
+        factors.report("factors (%s)" % category)
 
-        tree = f.Get("eventTree")
-        checkSamples(tree, fileName, variable, category)
+    if flipNegativeBins:
+        outs = [flipped_negative_bins(out) for out in outs]  # modifies histograms and adds tracking histograms
+    return outs
+
+
+def summed(partials):
+    """[{destProc: sum of h over partials}] from partials, a list of [{destProc: h}]"""
+    out = []
+    for ds in zip(*partials):
+        total = {}
+        for d in ds:
+            for destProc, h in d.iteritems():
+                if destProc in total:
+                    total[destProc].add(h)
+                else:
+                    total[destProc] = h.copy()
+        out.append(total)
+    return out
 
-        # first layer of merging
-        for destProc, srcProcs in procs.iteritems():
-            if destProc == "data_obs" and not options.unblind:
-                continue
 
-            destProc += variation
+def partialKey(fileName, variation, specs, category):
+    """cache key of the (unscaled) first-layer histograms of one input file; its
+    contents also depend on the file's stamp, stored with them"""
+    return histo_cache.key(cacheFormat, cfg.plan().procsKey(category), os.path.abspath(fileName), variation, specs, category, options.unblind, options.shift)
 
-            for srcProc, h in histosOneFile(f, tree, bins, srcProcs, variable, cuts, category).iteritems():
-                if destProc not in out:
-                    out[destProc] = h.Clone(destProc)
-                    out[destProc].SetDirectory(0)
-                    out[destProc].Reset()
-                factor = -1.0 if srcProc[0] == "-" else 1.0
-                out[destProc].Add(h, factor)
 
-        applyFactor(out["QCD" + variation], f, hName=cfg.transfer_factor_name(category, "QCD", variation, cuts=cuts), unit=False)
-        applyFactor(out["W" + variation], f, hName=cfg.transfer_factor_name(category, "WJets", variation, cuts=cuts), unit=False)
+def loadPartial(fileName, variation, specs, category):
+    """histosOneVariation() of an input file, as stored by an earlier run (None if absent or stale)"""
+    stored = histo_cache.load(cfg.partialsDir, partialKey(fileName, variation, specs, category))
+    if stored is None:
+        return None
 
-        if any(["embed" in src for src in procs.get("ZTT", [])]):
-            print "WARNING: modifying ZTT"
-            applyFactor(out["ZTT" + variation], f, hName="MC2Embed2Cat_%s" % category, unit=(category != '0M'))
+    stamp, ds = stored
+    if stamp != histo_cache.fileStamp(fileName):
+        return None
+    return ds
 
-        merge_second_layer(out, f, variable, category, variation)
 
-        f.Close()
+def storePartial(fileName, variation, specs, category, ds):
+    histo_cache.store(cfg.partialsDir, partialKey(fileName, variation, specs, category), (histo_cache.fileStamp(fileName), ds), maxBytes=cfg.histoCacheMaxBytes)
 
-    if flipNegativeBins:
-        out = flipped_negative_bins(out)  # modifies histograms and adds tracking histograms
+
+def weight(proc):
+    xsFactor = "(fabs(xs - 80.95) < 0.01 || fabs(xs - 136.02) < 0.01) ? 0.108*3 : 1.0" #if proc.startswith("ST_t-channel") else "1.0"
+    mc = "%g*(%s)*triggerEff*xs*PUWeight*genEventWeight/initSumWeights" % (cfg.lumi, xsFactor)
+    # mc = "%g*triggerEff*xs*PUWeight/initEvents" % cfg.lumi
+    if cfg.isData(proc):
+        return "(1.0)"
+    elif cfg.isDataEmbedded(proc):
+        return "(triggerEff*embeddedWeight*decayModeWeight)"
+    elif cfg.isMcEmbedded(proc):
+        return "(embeddedWeight*%s)" % mc
+    elif cfg.isSignal(proc):
+        # return "(decayModeWeight*%s)" % mc
+        return "(%s)" % mc
+    else:
+        return "(%s)" % mc
+
+
+def selection(category, cuts):
+    """cuts common to all processes (everything but sampleName)"""
+    clauses = []
+    if category:
+        clauses.append('(Category=="%s")' % category)
+
+    for cutVarRaw, (cutMin, cutMax) in sorted(cuts.iteritems()):
+        invert = cutVarRaw[0] == "~"
+        cutVar = cutVarRaw[1:] if invert else cutVarRaw
+
+        cutString1 = []
+        if cutMin is not None:
+            cutString1.append("(%g < %s)" % (cutMin, cutVar))
+        if cutMax is not None:
+            cutString1.append("(%s < %g)" % (cutVar, cutMax))
+
+        if invert:
+            cutString1 = ["!(%s)" % (" && ".join(cutString1))]
+        clauses += cutString1
+
+    return " && ".join(clauses) if clauses else "1"
+
+
+def stripped(procs):
+    """unique process names, with leading '-' removed, in order"""
+    out = []
+    for proc_orig in procs:
+        proc = proc_orig[1:] if (proc_orig and proc_orig[0] == "-") else proc_orig
+        if proc not in out:
+            out.append(proc)
     return out
 
 
-def histosOneFile(f, tree, bins, procs, variable, cuts, category):
+def sampleIndex(names):
+    """expression evaluating to the position of sampleName in names (else -1)"""
+    return columns.index("sampleName", names)
+
+
+def sampleWeight(names):
+    """expression evaluating to the weight of the matching sample (else 0)"""
+    out = "0.0"
+    for name in reversed(names):
+        out = '(sampleName=="%s") ? %s : (%s)' % (name, weight(name), out)
+    return out
+
+
+def entryRuns(names, index, maxRuns=500, first=0, last=None):
+    """sorted [(first, last, position in names)] of the entries of names within [first, last)
+    (None if too fragmented)"""
+    if index is None:
+        return None
+
+    out = []
+    for iName, name in enumerate(names):
+        for a, b in index.get(name, {}).get("ranges", []):
+            a = max(a, first)
+            b = b if last is None else min(b, last)
+            if a < b:
+                out.append((a, b, iName))
+
+    if maxRuns < len(out):
+        return None
+    return sorted(out)
+
+
+def filled(tree, bins, names, variable, cuts, category, index=None):
+    """one histogram per sample name, filled in a single pass over the tree
+    (restricted to each sample's entry ranges, if an index is given)"""
+    if entryRuns(names, index) is not None:
+        # one TTree::Draw per run would parse a new weight string each time
+        return filledMany(tree, [(bins, variable, cuts)], names, category, index)[0]
+
     if type(bins) is list:
         a = array.array('d', bins)
         bins = (len(a) - 1, a)
 
+    nNames = len(names)
+
+    # x = variable; y = index of sample
+    h2 = r.TH2D("h2_fill", "", *(bins + (nNames, -0.5, nNames - 0.5)))
+    h2.Sumw2()
+    tree.Draw("%s:%s>>h2_fill" % (sampleIndex(names), variable), '(%s)*(%s)' % (sampleWeight(names), selection(category, cuts)))
+    h2.SetDirectory(0)
+
     out = {}
-    for proc_orig in procs:
-        if proc_orig and proc_orig[0] == "-":
-            proc = proc_orig[1:]
-        else:
-            proc = proc_orig
-
-        h = r.TH1D(proc, proc+";%s;events / bin" % variable, *bins)
-        h.Sumw2()
-
-        xsFactor = "(fabs(xs - 80.95) < 0.01 || fabs(xs - 136.02) < 0.01) ? 0.108*3 : 1.0" #if proc.startswith("ST_t-channel") else "1.0"
-        mc = "%g*(%s)*triggerEff*xs*PUWeight*genEventWeight/initSumWeights" % (cfg.lumi, xsFactor)
-        # mc = "%g*triggerEff*xs*PUWeight/initEvents" % cfg.lumi
-        if cfg.isData(proc):
-            w = "(1.0)"
-        elif cfg.isDataEmbedded(proc):
-            w = "(triggerEff*embeddedWeight*decayModeWeight)"
-        elif cfg.isMcEmbedded(proc):
-            w = "(embeddedWeight*%s)" % mc
-        elif cfg.isSignal(proc):
-            # w = "(decayModeWeight*%s)" % mc
-            w = "(%s)" % mc
-        else:
-            w = "(%s)" % mc
+    for iName, proc in enumerate(names):
+        h = h2.ProjectionX("%s_px" % proc, 1 + iName, 1 + iName, "e")
+        h.SetDirectory(0)
+        h.SetName(proc)
+        h.SetTitle(proc+";%s;events / bin" % variable)
+        out[proc] = hist.fromTH1(h)
+    return out
 
-        cutString = '(sampleName=="%s")' % proc
-        if category:
-            cutString += ' && (Category=="%s")' % category
 
-        for cutVarRaw, (cutMin, cutMax) in sorted(cuts.iteritems()):
-            invert = cutVarRaw[0] == "~"
-            cutVar = cutVarRaw[1:] if invert else cutVarRaw
+def rebinnable(fineEdges, edges):
+    """True if every edge coincides with one of fineEdges"""
+    tolerance = 1.0e-9 * (fineEdges[-1] - fineEdges[0])
+    for x in edges:
+        i = bisect.bisect_left(fineEdges, x - tolerance)
+        if i == len(fineEdges) or tolerance < abs(fineEdges[i] - x):
+            return False
+    return True
 
-            cutString1 = ""
-            if cutMin is not None:
-                cutString1 += " && (%g < %s)" % (cutMin, cutVar)
-            if cutMax is not None:
-                cutString1 += " && (%s < %g)" % (cutVar, cutMax)
 
-            if invert:
-                cutString1 = " && !(%s)" % (cutString1[4:])
-            cutString += cutString1
+def fineHistos(fileName, group, bins):
+    """histograms from an earlier fill of group whose bin edges include all of bins (else None)"""
+    if type(bins) is not list:
+        return None
 
-        tree.Draw("%s>>%s" % (variable, proc), '(%s)*(%s)' % (w, cutString))
-        h.SetDirectory(0)
-        if options.shift:
-            shift(h)
+    if group in _filled.get(fileName, {}):
+        fineBins, hs = _filled[fileName][group]
+        if fineBins != bins and rebinnable(hist.edges(fineBins), bins):
+            return hs
+
+    if options.noCache or options.refreshCache:
+        return None
 
-        out[proc_orig] = h
+    for fineBins in histo_cache.load(cfg.histoCacheDir, histo_cache.key(group)) or []:
+        if fineBins != bins and rebinnable(hist.edges(fineBins), bins):
+            hs = histo_cache.load(cfg.histoCacheDir, histo_cache.key(group, fineBins))
+            if hs is not None:
+                return hs
+    return None
+
+
+def weightBranches(proc):
+    """branches used by weight(proc)"""
+    return expr.compiled(weight(proc)).branches()
+
+
+def evaluated(text, cols, sl, labels={}):
+    """the expression text, evaluated for the entries sl of the columns"""
+    e = expr.compiled(text)
+    return e.evaluate(dict([(b, cols[b][sl]) for b in e.branches()]), labels, n=sl.stop - sl.start)
+
+
+def weightArray(cols, proc, sl):
+    """weight(proc), evaluated for the entries sl of the columns"""
+    return evaluated(weight(proc), cols, sl)
+
+
+def selectionMask(snap, category, cuts, sl):
+    """selection(category, cuts), evaluated for the entries sl of the snapshot"""
+    return evaluated(selection(category, cuts), snap["columns"], sl, snap["labels"]) != 0
+
+
+def snapshotCovers(snap, names, variable, cuts, category):
+    """True if the snapshot has every branch needed by filledFromSnapshot"""
+    needed = set(expr.compiled(variable).branches() + expr.compiled(selection(category, cuts)).branches())
+    for name in names:
+        needed.update(weightBranches(name))
+    return needed.issubset(snap["columns"].keys())
+
+
+def weightColumn(snap):
+    """weight(sampleName) of each entry of the snapshot (0 for samples lacking weight branches),
+    computed once per snapshot and value of cfg.lumi"""
+    names = sorted([name for name in snap["samples"].keys() if set(weightBranches(name)).issubset(snap["columns"].keys())])
+
+    def compute(snap):
+        out = numpy.zeros(snap["entries"])
+        for name in names:
+            for first, last in snap["samples"][name]["ranges"]:
+                out[first:last] = weightArray(snap["columns"], name, slice(first, last))
+        return out
+
+    return snapshot.derived(snap, "weight: %s" % repr([(name, weight(name)) for name in names]), compute)
+
+
+def selectionColumn(snap, category, cuts):
+    """selectionMask() of each entry of the snapshot, computed once per snapshot"""
+    return snapshot.derived(snap, "selection: %s" % selection(category, cuts),
+                            lambda snap: selectionMask(snap, category, cuts, slice(0, snap["entries"])))
+
+
+def filledFromSnapshot(snap, bins, names, variable, cuts, category):
+    """same as filled(), but from the memory-mapped columns of a snapshot"""
+    w = weightColumn(snap)
+    keep = selectionColumn(snap, category, cuts)
+
+    out = {}
+    for proc in names:
+        xs = [numpy.zeros(0)]
+        ws = [numpy.zeros(0)]
+        for first, last in snap["samples"].get(proc, {}).get("ranges", []):
+            sl = slice(first, last)
+            xs.append(evaluated(variable, snap["columns"], sl)[keep[sl]])
+            ws.append(w[sl][keep[sl]])
+
+        sumw, sumw2 = columns.histogram(numpy.concatenate(xs), numpy.concatenate(ws), bins)
+        out[proc] = hist.Hist(proc, proc+";%s;events / bin" % variable, bins, sumw, sumw2)
+    return out
+
+
+def columnsBySample(tree, exprs, sel, names, index=None, first=0, last=None):
+    """[([one array per expression], weights)] for each of names, from a single pass over
+    the entries [first, last) of the tree
+
+    Only entries passing sel (which must be 0 or 1) are included; the
+    weights weight(name) are computed from the branches they use, by
+    expressions parsed once (see expr.py)."""
+    if last is None:
+        last = tree.GetEntries()
+
+    runs = entryRuns(names, index, first=first, last=last)
+    if runs is None:
+        reads = [(None, first, last)]
+        exprs = [sampleIndex(names)] + exprs
+    else:
+        reads = [(iName, a, b) for a, b, iName in runs]
+
+    weightExprs = [expr.compiled(weight(name)) for name in names]
+    branches = sorted(set(sum([e.branches() for e in weightExprs], [])))
+
+    values = [[[] for _ in exprs] for _ in names]
+    weights = [[] for _ in names]
+    for iName, first, last in reads:
+        for vs, _ in columns.chunks(tree, exprs + branches, sel, first=first, last=last):
+            cols = vs[len(exprs):]
+            vs = vs[:len(exprs)]
+            if iName is None:
+                masks = [(i, vs[0] == i) for i in range(len(names))]
+            else:
+                masks = [(iName, slice(None))]
+
+            for i, mask in masks:
+                for j, v in enumerate(vs):
+                    values[i][j].append(v[mask])
+                weights[i].append(weightExprs[i].evaluate(dict([(b, c[mask]) for b, c in zip(branches, cols)]), n=len(vs[0][mask])))
+
+    out = []
+    for i in range(len(names)):
+        vs = [numpy.concatenate([numpy.zeros(0)] + v) for v in values[i]]
+        if runs is None:
+            vs = vs[1:]  # sample index
+        out.append((vs, numpy.concatenate([numpy.zeros(0)] + weights[i])))
     return out
 
 
+def filledMany(tree, specs, names, category, index=None):
+    """like filled(), for each of several (bins, variable, cuts), from a single pass over the tree"""
+    nSpecs = len(specs)
+    sels = [selection(category, cuts) for _, _, cuts in specs]
+    exprs = [variable for _, variable, _ in specs] + sels
+    anySel = " || ".join(["(%s)" % sel for sel in sorted(set(sels))])
+
+    out = [{} for _ in specs]
+    for proc, (values, weights) in zip(names, columnsBySample(tree, exprs, anySel, names, index)):
+        for j, (bins, variable, _) in enumerate(specs):
+            keep = values[nSpecs + j] != 0
+            sumw, sumw2 = columns.histogram(values[j][keep], weights[keep], bins)
+            out[j][proc] = hist.Hist(proc, proc+";%s;events / bin" % variable, bins, sumw, sumw2)
+    return out
+
+
+def filledRdf(fileName, specs, names, category):
+    """like filledMany(), with every histogram booked on an RDataFrame and filled in
+    one event loop (multi-threaded unless --threads=1)"""
+    if options.threads != 1 and not r.ROOT.IsImplicitMTEnabled():
+        r.ROOT.EnableImplicitMT(options.threads)
+
+    df = r.RDataFrame("eventTree", fileName)
+    df = df.Define("hlim_sample", sampleIndex(names))
+    for iName, proc in enumerate(names):
+        df = df.Define("hlim_w%d" % iName, weight(proc))  # evaluated only for entries reaching a Histo1D
+
+    results = []
+    for j, (bins, variable, cuts) in enumerate(specs):
+        if type(bins) is list:
+            a = array.array('d', bins)
+            bins = (len(a) - 1, a)
+
+        x = "hlim_x%d" % j
+        selected = df.Define(x, variable).Filter(selection(category, cuts))
+        booked = {}
+        for iName, proc in enumerate(names):
+            model = r.RDF.TH1DModel("%s_rdf%d" % (proc, j), proc+";%s;events / bin" % variable, *bins)
+            booked[proc] = selected.Filter("hlim_sample == %d" % iName).Histo1D(model, x, "hlim_w%d" % iName)
+        results.append(booked)
+
+    out = []
+    for booked in results:  # the first GetValue() runs the event loop for all of them
+        hs = {}
+        for proc, result in booked.iteritems():
+            h = result.GetValue()
+            h.SetName(proc)
+            hs[proc] = hist.fromTH1(h)
+        out.append(hs)
+    return out
+
+
+def filledUproot(tree, specs, names, category, index=None):
+    """like filledMany(), reading the tree with uproot: the variables, selections
+    and weights are evaluated by expr.py"""
+    variables = [expr.compiled(variable) for _, variable, _ in specs]
+    sels = [expr.compiled(selection(category, cuts)) for _, _, cuts in specs]
+    weights = [expr.compiled(weight(name)) for name in names]
+    branches = sorted(set(sum([e.branches() for e in variables + sels + weights], ["sampleName"])))
+
+    runs = entryRuns(names, index)
+    if runs is None:
+        reads = [(None, 0, rootless.entries(tree))]
+    else:
+        reads = [(iName, a, b) for a, b, iName in runs]
+
+    xs = [[[] for _ in names] for _ in specs]
+    ws = [[[] for _ in names] for _ in specs]
+    for iName, first, last in reads:
+        for cols, labels in rootless.chunks(tree, branches, first=first, last=last):
+            if iName is None:
+                sampleNames = labels["sampleName"]
+                masks = [(i, cols["sampleName"] == (sampleNames.index(name) if name in sampleNames else -1)) for i, name in enumerate(names)]
+            else:
+                masks = [(iName, slice(None))]
+
+            for i, mask in masks:
+                sub = dict([(b, c[mask]) for b, c in cols.iteritems()])
+                n = len(sub["sampleName"])
+                w = weights[i].evaluate(sub, labels, n=n)
+                for j in range(len(specs)):
+                    keep = sels[j].evaluate(sub, labels, n=n) != 0
+                    xs[j][i].append(variables[j].evaluate(sub, labels, n=n)[keep])
+                    ws[j][i].append(w[keep])
+
+    out = []
+    for j, (bins, variable, _) in enumerate(specs):
+        hs = {}
+        for i, proc in enumerate(names):
+            sumw, sumw2 = columns.histogram(numpy.concatenate([numpy.zeros(0)] + xs[j][i]), numpy.concatenate([numpy.zeros(0)] + ws[j][i]), bins)
+            hs[proc] = hist.Hist(proc, proc+";%s;events / bin" % variable, bins, sumw, sumw2)
+        out.append(hs)
+    return out
+
+
+def filledBlocks(args):
+    """[per block: [per spec: [per name: (sumw, sumw2)]]] for consecutive blocks of entries
+    (runs in a worker process when --chunk-jobs > 1)"""
+    fileName, specs, names, category, index, blocks = args
+    nSpecs = len(specs)
+    sels = [selection(category, cuts) for _, _, cuts in specs]
+    exprs = [variable for _, variable, _ in specs] + sels
+    anySel = " || ".join(["(%s)" % sel for sel in sorted(set(sels))])
+
+    f = r.TFile(fileName)
+    if f.IsZombie():
+        error(msg="(see above)", die=True)
+    tree = f.Get("eventTree")
+    columns.prune(tree, exprs + [sampleWeight(names), "sampleName"])
+
+    out = []
+    for first, last in blocks:
+        block = [[None] * len(names) for _ in specs]
+        for i, (values, weights) in enumerate(columnsBySample(tree, exprs, anySel, names, index, first, last)):
+            for j, (bins, _, _) in enumerate(specs):
+                keep = values[nSpecs + j] != 0
+                block[j][i] = columns.histogram(values[j][keep], weights[keep], bins)
+        out.append(block)
+
+    f.Close()
+    return out
+
+
+def filledChunked(fileName, nEntries, specs, names, category, index=None, nJobs=1):
+    """like filledMany(), with blocks of entries filled in nJobs worker processes and then summed
+
+    The blocks have a fixed size and are summed in order, so the result
+    does not depend on nJobs (but may differ from filled() in the last bits)."""
+    blocks = [(first, min(first + blockEntries, nEntries)) for first in range(0, nEntries, blockEntries)]
+    size = max(1, int(math.ceil(len(blocks) / float(max(1, nJobs)))))
+    args = [(fileName, specs, names, category, index, blocks[i:i + size]) for i in range(0, len(blocks), size)]
+
+    totals = []
+    for bins, _, _ in specs:
+        nBins = len(bins) - 1 if type(bins) is list else bins[0]
+        totals.append([(numpy.zeros(2 + nBins), numpy.zeros(2 + nBins)) for _ in names])
+
+    for partials in mapped(filledBlocks, args, nJobs):
+        for block in partials:
+            for j in range(len(specs)):
+                for i in range(len(names)):
+                    sumw, sumw2 = totals[j][i]
+                    sumw += block[j][i][0]  # in place
+                    sumw2 += block[j][i][1]
+
+    out = []
+    for (bins, variable, _), total in zip(specs, totals):
+        out.append(dict([(proc, hist.Hist(proc, proc+";%s;events / bin" % variable, bins, w, w2)) for proc, (w, w2) in zip(names, total)]))
+    return out
+
+
+def scanGrid(args=[]):
+    """[(cutVar, direction, thresholds)] from strings such as 'pfMEt>0,20,40' or 'mt_1<50,70'"""
+    out = []
+    for arg in args:
+        m = re.match(r"^\s*(\w+)\s*([<>])\s*([-+0-9.eE,\s]+)$", arg)
+        if not m:
+            error("could not parse scan '%s' (expected e.g. 'pfMEt>0,20,40')." % arg)
+        cutVar, direction, thresholds = m.groups()
+        out.append((cutVar, direction, sorted([float("%g" % float(t)) for t in thresholds.split(",") if t.strip()])))
+
+    if not (1 <= len(out) <= 2):
+        error("scan one or two cut variables (not %d)." % len(out))
+    return out
+
+
+def cumulated(a, axis, direction):
+    """yields for each threshold, from counts in bins of 'number of thresholds below x' (for '>')
+    or 'number of thresholds at or below x' (for '<')"""
+    a = numpy.swapaxes(a, 0, axis)
+    if direction == ">":  # x > t_i  <==>  bin > i
+        out = numpy.cumsum(a[::-1], axis=0)[::-1][1:]
+    else:  # x < t_i  <==>  bin <= i
+        out = numpy.cumsum(a, axis=0)[:-1]
+    return numpy.swapaxes(out, 0, axis)
+
+
+def filledScan(tree, bins, names, variable, cuts, category, grid, index=None):
+    """{grid point: {proc: histogram}} for every point of the grid of cut thresholds,
+    from cumulative (thresholds x variable) histograms filled in a single pass"""
+    cutVars = [cutVar for cutVar, _, _ in grid]
+    baseCuts = dict([(k, v) for k, v in cuts.iteritems() if k.lstrip("~") not in cutVars])
+    nBins = len(bins) - 1 if type(bins) is list else bins[0]
+    shape = [1 + len(thresholds) for _, _, thresholds in grid] + [2 + nBins]
+
+    points = list(itertools.product(*[range(len(thresholds)) for _, _, thresholds in grid]))
+    out = dict([(point, {}) for point in points])
+    for proc, (values, weights) in zip(names, columnsBySample(tree, [variable] + cutVars, selection(category, baseCuts), names, index)):
+        iFlat = columns.binIndices(values[0], bins)
+        stride = 2 + nBins
+        for k in reversed(range(len(grid))):
+            cutVar, direction, thresholds = grid[k]
+            iThreshold = numpy.searchsorted(thresholds, values[1 + k], side="left" if direction == ">" else "right")
+            iFlat = iFlat + iThreshold * stride
+            stride *= shape[k]
+
+        sumw = numpy.bincount(iFlat, weights=weights, minlength=stride).reshape(shape)
+        sumw2 = numpy.bincount(iFlat, weights=weights * weights, minlength=stride).reshape(shape)
+        for k, (_, direction, _) in enumerate(grid):
+            sumw = cumulated(sumw, k, direction)
+            sumw2 = cumulated(sumw2, k, direction)
+
+        for point in points:
+            out[point][proc] = hist.Hist(proc, proc+";%s;events / bin" % variable, bins, sumw[point], sumw2[point])
+    return out
+
+
+def pointCuts(cuts, grid, point):
+    """cuts, with the scanned variables' thresholds set to those of point"""
+    cutVars = [cutVar for cutVar, _, _ in grid]
+    out = dict([(k, v) for k, v in cuts.iteritems() if k.lstrip("~") not in cutVars])
+    for (cutVar, direction, thresholds), i in zip(grid, point):
+        out[cutVar] = (thresholds[i], None) if direction == ">" else (None, thresholds[i])
+    return out
+
+
+def scan(var={}, grid=[]):
+    """nominal shapes, yields and best s/sqrt(b) (see look_sb.py) for each point of a grid of cut thresholds"""
+    needRoot("--scan")
+    bins = var["bins"]
+    variable = var["var"]
+    if cfg.rescaleX:
+        bins, variable = rescaled_bins(bins, variable)
+
+    fOut = r.TFile(cfg.outFileName(tag="_scan", **var), "RECREATE")
+    for category, tag in cfg.plan().categories:
+        procs = cfg.plan().procs(category)
+        active = [(destProc, srcProcs) for destProc, srcProcs in sorted(procs.iteritems())
+                  if options.unblind or destProc != "data_obs"]
+        srcProcs = sum([srcProcs for _, srcProcs in active], [])
+        names = stripped(srcProcs)
+
+        fileNames = cfg.plan().files(category)[""]
+        fileName = fileNames[0]
+        if 1 < len(fileNames):
+            print "WARNING: scanning only %s (of %s)" % (fileName, ", ".join(fileNames))
+        f = r.TFile(fileName)
+        if f.IsZombie():
+            error(msg="(see above)", die=True)
+        tree = f.Get("eventTree")
+        columns.prune(tree, [variable, selection(category, var["cuts"]), sampleWeight(names)] + [cutVar for cutVar, _, _ in grid] + sample_index.exprs)
+        index = sample_index.get(fileName, tree)
+
+        dTag = fOut.mkdir(tag)
+        signals = sorted([destProc for destProc, _ in active if cfg.isSignal(destProc)])
+        header = "  ".join(["%-30s" % "cuts", "%9s" % "sum_b"] + ["%9s" % signal for signal in signals])
+        print tag, "(best s/sqrt(b) of a bin)"
+        print header
+        print "-" * len(header)
+
+        for point, hs in sorted(filledScan(tree, bins, names, variable, var["cuts"], category, grid, index).iteritems()):
+            if options.shift:
+                for h in hs.values():
+                    h.shift()
+
+            cuts = pointCuts(var["cuts"], grid, point)
+            out = firstLayer(dict([(proc_orig, hs[stripped([proc_orig])[0]]) for proc_orig in srcProcs]), active, "")
+            applyFactors(out, fileName, procs, variable, cuts, category, "")
+            hb = sumb(out)[0]
+
+            desc = cfg.cutDesc(dict([(cutVar, cuts[cutVar]) for cutVar, _, _ in grid]))
+            dTag.mkdir(desc).cd()
+            th1s = dict([(h.name, h.toTH1()) for h in out.values() + [hb]])
+            for name, h in sorted(th1s.iteritems()):
+                h.Write()
+
+            fields = ["%-30s" % desc, "%9.3f" % hb.integral(0, 1 + hb.nBins())]
+            for signal in signals:
+                iBin, x = look_sb.best_bin(th1s[signal], th1s[hb.name])
+                fields.append("%9.3f" % x if iBin is not None else "%9s" % "-")
+            print "  ".join(fields)
+        print
+        if options.factors:
+            factors.report("factors (%s)" % category)
+        f.Close()
+    fOut.Close()
+
+
+def histosOneFile(fileName, tree, specs, procs, category, index=None, snap=None):
+    """[{proc: histogram}], one for each (bins, variable, cuts) in specs"""
+    names = stripped(procs)
+
+    hss = []
+    todo = []
+    for bins, variable, cuts in specs:
+        # everything but the binning which determines the contents
+        group = (cacheFormat, options.backend, histo_cache.fileStamp(fileName), variable, selection(category, cuts), sampleIndex(names), sampleWeight(names))
+
+        hs = None
+        if not (options.noCache or options.refreshCache):
+            hs = histo_cache.load(cfg.histoCacheDir, histo_cache.key(group, bins))
+
+        if hs is None:
+            fine = fineHistos(fileName, group, bins)
+            if fine is not None:
+                hs = dict([(proc, h.rebinned(bins)) for proc, h in fine.iteritems()])
+
+        if hs is None:
+            todo.append((len(hss), group))
+        hss.append(hs)
+
+    if todo and options.backend == "rdf":
+        fills = filledRdf(fileName, [specs[i] for i, _ in todo], names, category)
+    elif snap is not None:
+        fills = [filledFromSnapshot(snap, specs[i][0], names, specs[i][1], specs[i][2], category) for i, _ in todo]
+    elif todo and options.backend == "uproot":
+        fills = filledUproot(tree, [specs[i] for i, _ in todo], names, category, index)
+    elif todo and options.chunkJobs:
+        fills = filledChunked(fileName, tree.GetEntries(), [specs[i] for i, _ in todo], names, category, index, options.chunkJobs)
+    elif len(todo) == 1:
+        bins, variable, cuts = specs[todo[0][0]]
+        fills = [filled(tree, bins, names, variable, cuts, category, index)]
+    elif todo:
+        fills = filledMany(tree, [specs[i] for i, _ in todo], names, category, index)
+    else:
+        fills = []
+
+    if todo:
+        stages.count(entries=sum([index.get(name, {}).get("entries", 0) for name in names]) if index else 0)
+
+    if todo:
+        _filled[fileName] = {}  # one fill per input file is kept in memory (earlier ones are in the histo cache)
+    for (i, group), hs in zip(todo, fills):
+        bins = specs[i][0]
+        hss[i] = hs
+        _filled[fileName][group] = (bins, hs)
+        if not options.noCache:
+            histo_cache.store(cfg.histoCacheDir, histo_cache.key(group, bins), hs, maxBytes=cfg.histoCacheMaxBytes)
+            binnings = histo_cache.load(cfg.histoCacheDir, histo_cache.key(group)) or []
+            if bins not in binnings:
+                histo_cache.store(cfg.histoCacheDir, histo_cache.key(group), binnings + [bins])
+
+    outs = []
+    for hs in hss:
+        copies = {}
+        for proc in names:
+            copies[proc] = hs[proc].copy()  # hs are kept (unshifted) for rebinning
+            if options.shift:
+                copies[proc].shift()
+
+        out = {}
+        for proc_orig in procs:
+            out[proc_orig] = copies[stripped([proc_orig])[0]]
+        outs.append(out)
+    return outs
+
+
 def printSampleInfo(xs, ini):
     n = max([len(x) for x in xs.keys()])
     header = "      ".join(["sample".ljust(n),
@@ -234,31 +951,31 @@ def printSampleInfo(xs, ini):
     print "-" * len(header)
 
 
-def checkSamples(tree, fileName=".root file", variable="", category=""):
+def sampleTable(index):
+    """{sampleName: set of xs values}, {sampleName: set of initEvents values}"""
     xs = collections.defaultdict(set)
     ini = collections.defaultdict(set)
+    for sn, d in index.iteritems():
+        xs[sn].update(d["xs"])
+        ini[sn].update(d["initEvents"])
+    return xs, ini
 
-    for iEntry in range(tree.GetEntries()):
-        tree.GetEntry(iEntry)
-        sn = tree.sampleName
-        if sn.find("\x00") != -1:
-            sn = sn[:sn.find("\x00")]
-        xs[sn].add(tree.xs)
-        ini[sn].add(tree.initEvents)
 
-        if options.allowMultiXs:
-            continue
+def checkSamples(index, fileName=".root file", variable="", category=""):
+    xs, ini = sampleTable(index)
 
-        if len(xs[sn]) != 1:
-            error("sample %s (file %s) has multiple values of xs: %s" % (sn, fileName, xs[sn]))
-        if len(ini[sn]) != 1:
-            error("sample %s (file %s) has multiple values of ini: %s" % (sn, fileName, ini[sn]))
+    if not options.allowMultiXs:
+        for sn in sorted(xs.keys()):
+            if len(xs[sn]) != 1:
+                error("sample %s (file %s) has multiple values of xs: %s" % (sn, fileName, xs[sn]))
+            if len(ini[sn]) != 1:
+                error("sample %s (file %s) has multiple values of ini: %s" % (sn, fileName, ini[sn]))
 
     if options.xs:
         printSampleInfo(xs, ini)
 
     extra = []
-    for proc in sum(cfg.procs(variable, category).values(), []):
+    for proc in sum(cfg.plan().procs(category).values(), []):
         if proc and proc[0] == "-":
             proc = proc[1:]
         if proc in xs:
@@ -275,39 +992,36 @@ def checkSamples(tree, fileName=".root file", variable="", category=""):
                              ])
 
 
-def applyFactor(h=None, tfile=None, hName="", unit=False):
+def applyFactor(h=None, fileName="", hName="", unit=False):
     if unit:
-        i = h.Integral(0, 1 + h.GetNbinsX())  # fixme: under/overflows?
+        i = h.integral(0, 1 + h.nBins())  # fixme: under/overflows?
         if not i:
-            error("Empty histogram '%s'." % h.GetName(), die=False)
+            error("Empty histogram '%s'." % h.name, die=False)
         else:
-            h.Scale(1.0 / i)
+            h.scale(1.0 / i)
 
-    hFactor = tfile.Get(hName)
-    if not hFactor:
-        error("Could not find histogram '%s' in file '%s'." % (hName, tfile.GetName()))
-    factor = hFactor.GetBinContent(1)
-    unc = hFactor.GetBinError(1)
-    if options.factors:
-        print "%s: %8.6f +- %8.6f  (%8.6f)" % (hName, factor, unc, unc / factor)
-    h.Scale(factor)
+    found = factors.get(fileName, hName, overlay=options.factorOverlay)
+    if found is None:
+        error("Could not find histogram '%s' in file '%s'%s." % (hName, fileName, (" nor '%s'" % options.factorOverlay) if options.factorOverlay else ""))
+    factor, unc = found
+    h.scale(factor)
 
 
 def describe(h, l, keys):
-    print l, h.GetXaxis().GetTitle(), "(sum of %s)" % str(sorted(keys))
+    print l, h.xTitle(), "(sum of %s)" % str(sorted(keys))
     headers = "bin    x_lo        width    cont  +-   err    (   rel)"
     print l, headers
     print l, "-" * len(headers)
-    for iBinX in range(1, 1 + h.GetNbinsX()):
-        x = h.GetBinLowEdge(iBinX)
-        c = h.GetBinContent(iBinX)
-        e = h.GetBinError(iBinX)
-        w = h.GetBinWidth(iBinX)
+    for iBinX in range(1, 1 + h.nBins()):
+        x = h.lowEdge(iBinX)
+        c = h.content(iBinX)
+        e = h.error(iBinX)
+        w = h.width(iBinX)
         s = " %2d   %9.2e   %6.2f   %7.1e +- %7.1e" % (iBinX, x, w, c, e)
         if c:
             s += "  (%5.1f%s)" % (100.*e/c, "%")
         print l, s
-    print l, "sum".ljust(12) + " = %9.3f" % h.Integral(0, 1 + h.GetNbinsX())
+    print l, "sum".ljust(12) + " = %9.3f" % h.integral(0, 1 + h.nBins())
     print
 
 
@@ -330,21 +1044,107 @@ def printTag(tag, l):
     print l, a
 
 
+def histosOneCategory(args):
+    """histograms for one category (runs in a worker process when --category-jobs > 1)"""
+    category, vars, skipVariations, flipNegativeBins = args
+    specs = [(var["bins"], var["var"], var["cuts"]) for var in vars]
+    with stages.stage("category", category=category):
+        return histosMany(specs, category=category, skipVariations=skipVariations, flipNegativeBins=flipNegativeBins)
+
+
 def go(var={}, sFactor=0, sKey="", categoryWhitelist=None, skipVariations=False, flipNegativeBins=False):
+    """var is a dict (see cfg.variable), or a list of them: each is then filled
+    in the same pass over the input files and written to its own file"""
     assert var
-    printHeader(**var)
+    vars = var if type(var) is list else [var]
 
-    l = " " * 4
-    f = r.TFile(cfg.outFileName(sFactor=sFactor, sKey=sKey, **var), "RECREATE")
-    for category, tag in cfg.categories.iteritems():
+    todo = []
+    for category, tag in cfg.plan().categories:
         if categoryWhitelist and category not in categoryWhitelist:
             continue
-        hs = histos(category=category, bins=var["bins"], variable=var["var"], cuts=var["cuts"], skipVariations=skipVariations, flipNegativeBins=flipNegativeBins)
-        if options.integrals or options.xs or options.contents:
-            printTag(tag, l)
-        f.mkdir(tag).cd()
-        oneTag(category, tag, hs, sKey, sFactor, l)
-    f.Close()
+        todo.append((category, tag))
+
+    fileNames = [cfg.outFileName(sFactor=sFactor, sKey=sKey, **v) for v in vars]
+    key = None
+    if options.skipUnchanged:
+        key = runKey(vars, fileNames, [category for category, _ in todo], sFactor, sKey, skipVariations, flipNegativeBins)
+        if all([storedRunKey(fileName) == key for fileName in fileNames]):
+            print "%s: unchanged (run key %s); skipping" % (", ".join(fileNames), key[:10])
+            return
+
+    for v in vars:
+        printHeader(**v)
+
+    l = " " * 4
+    fs = [outputFile(fileName) for fileName in fileNames]
+
+    # categories are filled concurrently, but written one at a time, in order; each
+    # category's histograms (all processes, variations and vars) are in memory at once
+    args = [(category, vars, skipVariations, flipNegativeBins) for category, _ in todo]
+    for (category, tag), hss in itertools.izip(todo, mapped(histosOneCategory, args, options.categoryJobs)):
+        for v, f, hs in zip(vars, fs, hss):
+            if options.integrals or options.xs or options.contents:
+                printTag(tag if len(vars) == 1 else "%s  (%s)" % (tag, v["var"]), l)
+            with stages.stage("write", category=category, var=v["var"]):
+                oneTag(category, tag, hs, sKey, sFactor, l, f.mkdir(tag))  # empties hs
+        del hss
+
+    for f in fs:
+        f.Close()
+    if key is not None:
+        for fileName in fileNames:
+            storeRunKey(fileName, key)
+
+
+def runKey(vars, fileNames, categories, sFactor, sKey, skipVariations, flipNegativeBins):
+    """hash of everything which determines the output files of go(): the plan of the
+    categories, the inputs read and the options (but not those setting only the parallelism)"""
+    plan = cfg.plan()
+    stamps = [histo_cache.fileStamp(fileName) for category in categories for fileName in plan.inputs(category, skipVariations)]
+    if options.factorOverlay:
+        stamps.append(histo_cache.fileStamp(options.factorOverlay))
+    settings = [(k, v) for k, v in sorted(options.__dict__.iteritems())
+                if k not in ["jobs", "categoryJobs", "chunkJobs", "threads", "profile", "skipUnchanged"]]
+    return histo_cache.key(cacheFormat, [plan.categoryKey(category) for category in categories], vars, cfg.rescaleX, fileNames,
+                           sFactor, sKey, skipVariations, flipNegativeBins, stamps, settings)
+
+
+def storedRunKey(fileName):
+    """runKey() of the go() which wrote fileName (None if unknown)"""
+    if not os.path.exists(outputPath(fileName)):
+        return None
+    try:
+        return open("%s.key" % fileName).read().strip()
+    except IOError:
+        return None
+
+
+def storeRunKey(fileName, key):
+    f = open("%s.key" % fileName, "w")
+    f.write(key + "\n")
+    f.close()
+
+
+def outputPath(fileName):
+    """fileName, or with --backend=uproot its .npz"""
+    if options.backend == "uproot":
+        return fileName.replace(".root", ".npz")
+    return fileName
+
+
+def outputFile(fileName):
+    """TFile, or with --backend=uproot a shapes.File (.npz)"""
+    if options.backend == "uproot":
+        return shapes.File(outputPath(fileName))
+    return r.TFile(fileName, "RECREATE")
+
+
+def write(d, h):
+    """write h into d, a directory of an output file"""
+    if isinstance(d, shapes.Directory):
+        d.write(h)
+    else:
+        d.WriteTObject(h.toTH1(), h.name)
 
 
 def printIntegrals(lst=[], l=""):
@@ -358,15 +1158,25 @@ def printIntegrals(lst=[], l=""):
     print l, hyphens
 
 
-def oneTag(category, tag, hs, sKey, sFactor, l):
+def oneTag(category, tag, hs, sKey, sFactor, l, d):
+    """write each histogram of hs into the directory d (emptying hs), keeping
+    in memory only the sums needed for sum_b and the fake dataset
+
+    hs already holds every process and variation of the category, so the
+    peak memory still grows with their number (and with that of the specs);
+    writing only frees them sooner than writing them all at the end."""
+    suffixes = sorted(cfg.plan().files(category).keys()) if options.sumb else [""]
+    sums = dict([(suffix, (None, [])) for suffix in suffixes])
+    signal = hs[sKey].copy() if sFactor else None
+
     integrals = []
     # scale and write
-    for (proc, h) in hs.iteritems():
+    for proc in sorted(hs.keys()):
+        h = hs.pop(proc)
         if not h:
             print "ERROR: %s" % proc, h
             continue
 
-        #h.Print("all")
         if cfg.isSignal(proc) and cfg.substring_signal_example not in proc:
             pass
         elif cfg.isVariation(proc):
@@ -374,30 +1184,35 @@ def oneTag(category, tag, hs, sKey, sFactor, l):
         elif cfg.isFlippedTracker(proc):
             pass
         else:
-            integrals.append((tag, proc, h.Integral(0, 2 + h.GetNbinsX())))
+            integrals.append((tag, proc, h.integral(0, 2 + h.nBins())))
 
-        h.Write()
+        write(d, h)
+
+        for suffix, (total, keys) in sums.items():
+            if inSumb(proc, suffix):
+                sums[suffix] = (accumulated(total, h, "sum_b" + suffix), keys + [proc])
+        del h
 
     if options.integrals:
         printIntegrals(integrals, l)
 
     if not options.unblind:
-        fakeDataset(hs, sKey, sFactor, l).Write()
+        total, keys = sums[""]
+        write(d, fakeDataset(total.copy("data_obs"), keys, signal, sKey, sFactor, l))
 
     if options.sumb:
-        suffixes = sorted(cfg.files(category).keys())
         for suffix in suffixes:
-            h, keys = sumb(hs, suffix=suffix)
+            h, keys = sums.pop(suffix)
             if not h:  # due to go(skipVariations=True)
                 print "skipping", suffix
                 continue
-            h.Write()
+            write(d, h)
             if options.contents:
                 if suffix:
-                    nOld = len(l) + len(h.GetXaxis().GetTitle())
+                    nOld = len(l) + len(h.xTitle())
                     print "%s %s = %9.3f  %s %s" % (l,
                                                     "sum".ljust(12),
-                                                    h.Integral(0, 1 + h.GetNbinsX()),
+                                                    h.integral(0, 1 + h.nBins()),
                                                     "(sum of %s)" % str(sorted([x.replace(suffix, "") for x in keys])),
                                                     suffix,
                                                     )
@@ -408,62 +1223,66 @@ def oneTag(category, tag, hs, sKey, sFactor, l):
             print
 
 
-def sumb(hs, name="sum_b", suffix=""):
-    name += suffix
+def inSumb(key, suffix=""):
+    """True if key is one of the backgrounds summed by sumb()"""
+    if cfg.isSignal(key):
+        return False
+    if cfg.isData(key):
+        return False
+    if cfg.isFlippedTracker(key):
+        return False
+    if (not suffix) and cfg.isVariation(key):
+        return False
+    if suffix and not key.endswith(suffix):
+        return False
+    return True
+
+
+def accumulated(d, histo, name):
+    """d + histo (d may be None)"""
+    if d is None:
+        d = histo.empty(name)
+        d.setTitle(name)
+    d.add(histo)
+    return d
 
+
+def sumb(hs, name="sum_b", suffix=""):
     d = None
     keys = []
-    for key, histo in hs.iteritems():
-        if cfg.isSignal(key):
-            continue
-        if cfg.isData(key):
-            continue
-        if cfg.isFlippedTracker(key):
-            continue
-        if (not suffix) and cfg.isVariation(key):
-            continue
-        if suffix and not key.endswith(suffix):
-            continue
-
-        if d is None:
-            d = histo.Clone(name)
-            d.SetTitle(name)
-            d.Reset()
-        d.Add(histo)
-        keys.append(key)
+    for key, histo in sorted(hs.iteritems()):
+        if inSumb(key, suffix):
+            d = accumulated(d, histo, name + suffix)
+            keys.append(key)
     return d, keys
 
 
-def fakeDataset(hs, sKey, sFactor, l):
+def fakeDataset(d, keys, signal, sKey, sFactor, l):
+    """d (the sum of the backgrounds keys), plus sFactor times signal, integerized"""
     assert type(sFactor) is int, type(sFactor)
 
-    d, keys = sumb(hs, name="data_obs")
+    d.setTitle(d.name)
     if options.contents:
         describe(d, l, keys)
 
     zTitle = "Observed = floor(sum(bkg)"  # missing ) added below
     if sFactor:
-        d.Add(hs[sKey], sFactor)
+        d.add(signal, sFactor)
         if sFactor != 1:
             zTitle += " + %d#times" % sFactor
         else:
             zTitle += " + "
-        zTitle += "%s %s)" % (sKey.replace("2hh", ""), hs[sKey].GetZaxis().GetTitle())
+        zTitle += "%s %s)" % (sKey.replace("2hh", ""), signal.zTitle)
     else:
         zTitle += ")"
 
-    d.GetZaxis().SetTitle(zTitle)
-
-    # integerize
-    for iBin in range(1, 1 + d.GetNbinsX()):
-        c = math.floor(d.GetBinContent(iBin))
-        d.SetBinContent(iBin, c)
-        d.SetBinError(iBin, math.sqrt(max(0.0, c)))
+    d.zTitle = zTitle
 
+    d.floor()  # integerize
     return d
 
 
-def opts():
+def opts(args=None):
     parser = optparse.OptionParser()
 
     parser.add_option("--contents",
@@ -490,12 +1309,24 @@ def opts():
                       action="store_true",
                       help="print loose-to-tight and embedded-sample rate factors")
 
+    parser.add_option("--factor-overlay",
+                      dest="factorOverlay",
+                      default="",
+                      metavar="FILE",
+                      help="take rate factors from FILE (.json: {name: [value, unc]}, or .root) when it has them")
+
     parser.add_option("--shift",
                       dest="shift",
                       default=False,
                       action="store_true",
                       help="shift under- and over-flows into visible bins")
 
+    parser.add_option("--flip-summary",
+                      dest="flipSummary",
+                      default=False,
+                      action="store_true",
+                      help="with flipped negative bins, print per histogram the number of bins zeroed (or flipped), the sum of their negative contents and the resulting integral")
+
     parser.add_option("--allow-multi-xs",
                       dest="allowMultiXs",
                       default=False,
@@ -508,16 +1339,138 @@ def opts():
                       action="store_true",
                       help="use real data for data_obs rather than floor(sum(b))")
 
+    parser.add_option("--no-cache",
+                      dest="noCache",
+                      default=False,
+                      action="store_true",
+                      help="neither read nor write the histogram cache (cfg.histoCacheDir)")
+
+    parser.add_option("--refresh-cache",
+                      dest="refreshCache",
+                      default=False,
+                      action="store_true",
+                      help="refill all histograms, replacing their cache entries")
+
+    parser.add_option("--all-variables",
+                      dest="allVariables",
+                      default=False,
+                      action="store_true",
+                      help="fill each of cfg.variables() (one output file per variable) in a single pass")
+
+    parser.add_option("--scan",
+                      dest="scan",
+                      default=[],
+                      action="append",
+                      help="(instead of making histograms) scan a grid of thresholds of a cut variable, e.g. --scan='pfMEt>0,20,40' (may be given twice)")
+
+    parser.add_option("--make-snapshots",
+                      dest="makeSnapshots",
+                      default=False,
+                      action="store_true",
+                      help="(instead of making histograms) write columnar snapshots of the input files to cfg.snapshotDir")
+
+    parser.add_option("--use-snapshots",
+                      dest="useSnapshots",
+                      default=False,
+                      action="store_true",
+                      help="fill from memory-mapped snapshots (see --make-snapshots) when up to date")
+
+    parser.add_option("--skip-unchanged",
+                      dest="skipUnchanged",
+                      default=False,
+                      action="store_true",
+                      help="do nothing if the output files were written from the same plan, inputs and options")
+
+    parser.add_option("--append",
+                      dest="append",
+                      default=False,
+                      action="store_true",
+                      help="fill only input files which are new or changed since the previous run, reusing the others' histograms (cfg.partialsDir)")
+
+    parser.add_option("--backend",
+                      dest="backend",
+                      default="draw",
+                      type="choice",
+                      choices=["draw", "rdf", "uproot"],
+                      help="fill with TTree::Draw (draw, default), with one RDataFrame event loop per file (rdf), or without ROOT (uproot: writes .npz files, see shapes.py)")
+
+    parser.add_option("--threads",
+                      dest="threads",
+                      default=0,
+                      type="int",
+                      help="threads of the rdf backend (0: all cores; 1: no multi-threading, for identical sums)")
+
+    parser.add_option("--jobs",
+                      dest="jobs",
+                      default=1,
+                      type="int",
+                      help="number of worker processes used to fill the variation files")
+
+    parser.add_option("--chunk-jobs",
+                      dest="chunkJobs",
+                      default=0,
+                      type="int",
+                      help="fill fixed blocks of entries of each input file in this many worker processes, and sum them in order (the result does not depend on the number; 0 means no blocks)")
+
+    parser.add_option("--category-jobs",
+                      dest="categoryJobs",
+                      default=1,
+                      type="int",
+                      help="number of worker processes used to fill the categories (each then ignores --jobs)")
+
+    parser.add_option("--profile",
+                      dest="profile",
+                      default="",
+                      metavar="FILE",
+                      help="record wall and CPU time, entries and bytes read and peak memory of each stage; write them to FILE (JSON) and print a summary")
+
     parser.add_option("--sum-b",
                       dest="sumb",
                       default=False,
                       action="store_true",
                       help="store sum of all backgrounds (useful for choosing binning)")
 
-    options, args = parser.parse_args()
+    options, args = parser.parse_args(args)
+    if options.chunkJobs and (options.backend != "draw" or options.useSnapshots):
+        print "WARNING: --chunk-jobs applies only to --backend=draw without --use-snapshots; ignoring it"
+    elif 1 < options.chunkJobs and (1 < options.jobs or 1 < options.categoryJobs):
+        print "WARNING: within --jobs or --category-jobs workers, the blocks of --chunk-jobs are filled one at a time"
     return options
 
 
+def makeSnapshots(var={}):
+    """write a snapshot of each input file, holding the branches needed to fill var
+    and its per-event weights and selection"""
+    needRoot("--make-snapshots")
+    variable = var["var"]
+    bins = var["bins"]
+    if cfg.rescaleX:
+        bins, variable = rescaled_bins(bins, variable)
+
+    for category, _ in cfg.plan().categories:
+        names = stripped(sum(cfg.plan().procs(category).values(), []))
+        exprs = [variable, selection(category, var["cuts"])] + sum([weightBranches(name) for name in names], [])
+        for fileName in cfg.plan().inputs(category):
+            f = r.TFile(fileName)
+            if f.IsZombie():
+                error(msg="(see above)", die=True)
+            tree = f.Get("eventTree")
+
+            branches = [b for b in columns.branchesUsed(tree, exprs) if b != "sampleName"]  # the index has the samples
+            old = snapshot.load(cfg.snapshotDir, fileName)
+            if old is not None and set(branches).issubset(old["columns"].keys()):
+                print "snapshot of %s is up to date" % fileName
+            else:
+                print "writing snapshot of %s (%s)" % (fileName, ", ".join(branches))
+                snapshot.write(cfg.snapshotDir, fileName, tree, branches, sample_index.get(fileName, tree))
+            f.Close()
+
+            # per-event weights and selection, for --use-snapshots
+            snap = snapshot.load(cfg.snapshotDir, fileName)
+            weightColumn(snap)
+            selectionColumn(snap, category, var["cuts"])
+
+
 def ugly_setup():
     # ugh- redesign
     global options
@@ -528,4 +1481,16 @@ def ugly_setup():
 
 if __name__ == "__main__":
     options = opts()
-    go(cfg.variable())
+    if options.backend != "uproot":
+        needRoot("--backend=%s" % options.backend)
+    stages.enabled = bool(options.profile)
+    if options.makeSnapshots:
+        makeSnapshots(cfg.variable())
+    elif options.scan:
+        scan(cfg.variable(), scanGrid(options.scan))
+    elif options.allVariables:
+        go(cfg.variables())
+    else:
+        go(cfg.variable())
+    if options.profile:
+        stages.report(options.profile)
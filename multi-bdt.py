@@ -43,7 +43,8 @@ def make_root_file(dirName, fileName, variable, ini_bins=None, subdir="", minWid
         make_root_files.options.contents = True
         # make_root_files.options.factors = True
 
-    make_root_files.go(variable, categoryWhitelist=catlist, skipVariations=not staticBinning, flipNegativeBins=staticBinning)
+    # variations are filled at fine binning too, so that the second pass only rebins
+    make_root_files.go(variable, categoryWhitelist=catlist, flipNegativeBins=staticBinning)
 
     if staticBinning:
         return
@@ -118,7 +119,7 @@ def go_bdt(suffix="normal.root"):
     # clean up previous results
     os.system("rm -rf %s" % root_dest.bdt_tmp)
 
-    for mass in cfg.masses:
+    for mass in cfg.plan().masses:
         for fileIn in os.listdir(cfg.bdtDir):
             if ("_H%3d_%s" % (mass, suffix)) not in fileIn:
                 continue
@@ -141,7 +142,7 @@ def go_cb(suffix="normal.root"):
     variable = {"var": "fMassKinFit",
                 "cuts": {"fMassKinFit": (0.0, None), "mJJ": (70.0, 150.0), "svMass": (90.0, 150.0)},
                 }
-    mass = "%s" % " ".join(["%s" % x for x in cfg.masses])
+    mass = "%s" % " ".join(["%s" % x for x in cfg.plan().masses])
 
     fileOut = cfg.outFileName(**variable)
     dirOut = "%s_%s" % (variable["var"], cfg.cutDesc(variable["cuts"]))
@@ -173,8 +174,8 @@ def go_zp(suffix="normal.root"):
     fileOut = cfg.outFileName(**variable)
     dirOut = "%s_%s" % (variable["var"], cfg.cutDesc(variable["cuts"]))
 
-    for ch, subdir in cfg.categories.iteritems():
-        variations = set([key.replace("Up", "").replace("Down", "") for key in cfg.files(ch).keys()])
+    for ch, subdir in cfg.plan().categories:
+        variations = set([key.replace("Up", "").replace("Down", "") for key in cfg.plan().files(ch).keys()])
 
         bsm = [85, 100, 110, 120, 130, 140, 150, 160, 170, 180, 190, 200, 225, 250, 275, 300, 400, 600, 900]
         # dy_mbins = [0, 50, 100, 200, 400, 500, 700, 800, 1000, 1500]
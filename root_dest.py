@@ -2,12 +2,12 @@ import os
 import sys
 
 
-if "CMSSW_BASE" not in os.environ:
-    sys.exit("Set up the CMSSW environment.")
-
-root_dest = "%s/src/auxiliaries/shapes/Brown" % os.environ["CMSSW_BASE"]
-
-bdt_tmp = "%s/src/LIMITS-tmp/tt" % os.environ["CMSSW_BASE"]
+if "CMSSW_BASE" in os.environ:
+    root_dest = "%s/src/auxiliaries/shapes/Brown" % os.environ["CMSSW_BASE"]
+    bdt_tmp = "%s/src/LIMITS-tmp/tt" % os.environ["CMSSW_BASE"]
+else:  # e.g. make_root_files.py --backend=uproot, outside CMSSW
+    root_dest = os.environ.get("HLIM_ROOT_DEST", "shapes")
+    bdt_tmp = "LIMITS-tmp/tt"
 
 def copy(src="", channel="tt", era="8TeV", tag="Hhh", link=False):
     dest = "%s/%s" % (root_dest, "htt_%s.inputs-%s-%s.root" % (channel, tag, era))
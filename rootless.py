@@ -0,0 +1,89 @@
+"""reading of eventTree inputs and of histograms with uproot rather than ROOT
+
+uproot (version 3, the last one supporting Python 2) is imported when
+first needed.  String branches (sampleName, Category) are returned as
+int32 positions in a list of labels, as in snapshots, so that the
+expressions of expr.py can be evaluated on them."""
+
+import numpy
+
+import hist
+import sample_index
+
+
+def _uproot():
+    import uproot
+    return uproot
+
+
+def tree(fileName, name="eventTree"):
+    return _uproot().open(fileName)[name]
+
+
+def entries(tree):
+    return tree.numentries
+
+
+def coded(a):
+    """(int32 positions in labels, labels) of an array of strings (null padding removed)"""
+    raw, codes = numpy.unique(a, return_inverse=True)
+    clean = [str(x).split("\x00")[0] for x in raw.tolist()]
+    labels = sorted(set(clean))
+    lookup = numpy.array([labels.index(x) for x in clean], dtype=numpy.int32)
+    return lookup[codes], labels
+
+
+def converted(arrays):
+    cols = {}
+    labels = {}
+    for branch, a in arrays.iteritems():
+        if a.dtype.kind in "OS":
+            cols[branch], labels[branch] = coded(a)
+        else:
+            cols[branch] = a.astype(numpy.float64)
+    return cols, labels
+
+
+def chunks(tree, branches=[], chunkSize=1000000, first=0, last=None):
+    """yield (columns {branch: array}, labels {branch: [...]}) for each chunk of the entries [first, last)"""
+    for arrays in tree.iterate(branches, entrysteps=chunkSize, entrystart=first, entrystop=last, namedecode="utf-8"):
+        yield converted(arrays)
+
+
+def sampleIndex(fileName, tree):
+    """as sample_index.get"""
+    samples = sample_index.load(fileName)
+    if samples is None:
+        samples = {}
+        iEntry = 0
+        for cols, labels in chunks(tree, sample_index.exprs):
+            sample_index.update(samples, labels["sampleName"], cols["sampleName"], cols["xs"], cols["initEvents"], cols["genEventWeight"], iEntry)
+            iEntry += len(cols["xs"])
+        samples = sample_index.finished(samples)
+        sample_index.save(fileName, samples)
+    return samples
+
+
+def hists(fileName):
+    """{path: hist.Hist} of the 1D histograms in a file"""
+    f = _uproot().open(fileName)
+    out = {}
+    for name, c in f.allclasses():
+        name = name.split(";")[0]  # the highest cycle comes first
+        if name in out or not c.__name__.startswith("TH1"):
+            continue
+
+        h = f[name]
+        axis = h._fXaxis
+        if len(axis._fXbins):
+            bins = [float(x) for x in axis._fXbins]
+        else:
+            bins = (int(axis._fNbins), float(axis._fXmin), float(axis._fXmax))
+        title = "%s;%s;%s" % (h._fTitle, axis._fTitle, h._fYaxis._fTitle)
+        out[name] = hist.Hist(name.split("/")[-1], title, bins, h.allvalues, h.allvariances, h._fZaxis._fTitle)
+    return out
+
+
+def factors(fileName):
+    """{name: (content, error) of the first bin} of the 1D histograms in a file"""
+    return dict([(name, (h.content(1), h.error(1))) for name, h in hists(fileName).iteritems()])
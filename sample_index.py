@@ -0,0 +1,117 @@
+"""per-file index of the samples in an eventTree
+
+For each sampleName, the index records the ranges [first, last) of
+entries belonging to it, its distinct xs and initEvents values, its
+number of entries and its sum of genEventWeight.  It is stored as
+<file>.index.json next to the input and rebuilt whenever the input's
+size or mtime changes."""
+
+import json
+import os
+
+import numpy
+
+import columns
+
+exprs = ["sampleName", "xs", "initEvents", "genEventWeight"]  # branches read by build()
+
+
+def path(fileName):
+    return "%s.index.json" % fileName
+
+
+def stamp(fileName):
+    st = os.stat(fileName)
+    return [st.st_size, st.st_mtime]
+
+
+def load(fileName):
+    try:
+        f = open(path(fileName))
+    except IOError:
+        return None
+
+    try:
+        d = json.load(f)
+    except ValueError:
+        return None
+    finally:
+        f.close()
+
+    if d.get("stamp") != stamp(fileName):
+        return None
+    return decoded(d["samples"])
+
+
+def decoded(samples):
+    """samples read from json, with str (rather than unicode) names"""
+    return dict([(str(name), sample) for name, sample in samples.iteritems()])
+
+
+def save(fileName, samples):
+    try:
+        f = open(path(fileName), "w")
+    except IOError as e:
+        print "WARNING: could not save sample index of %s (%s)" % (fileName, e)
+        return
+    json.dump({"stamp": stamp(fileName), "samples": samples}, f, indent=1, sort_keys=True)
+    f.close()
+
+
+def update(samples, names, codes, xs, ini, genWeight, iEntry):
+    """add a chunk of entries, the first of which is iEntry; codes are positions in names"""
+    codes = codes.astype(numpy.int64)
+    if (codes < 0).any():
+        raise ValueError("entry %d has a sampleName not among %s" % (iEntry + numpy.flatnonzero(codes < 0)[0], names))
+
+    # runs of consecutive entries from the same sample
+    starts = numpy.concatenate([[0], 1 + numpy.flatnonzero(numpy.diff(codes))])
+    ends = numpy.concatenate([starts[1:], [len(codes)]])
+    for first, last in zip(starts.tolist(), ends.tolist()):
+        if first == last:
+            continue
+        ranges = samples.setdefault(names[codes[first]], new())["ranges"]
+        if ranges and ranges[-1][1] == iEntry + first:
+            ranges[-1][1] = iEntry + last
+        else:
+            ranges.append([iEntry + first, iEntry + last])
+
+    for i, name in enumerate(names):
+        mask = codes == i
+        if not mask.any():
+            continue
+        d = samples.setdefault(name, new())
+        d["xs"].update(numpy.unique(xs[mask]).tolist())
+        d["initEvents"].update(numpy.unique(ini[mask]).tolist())
+        d["entries"] += int(mask.sum())
+        d["sumWeights"] += float(genWeight[mask].sum())
+
+
+def new():
+    return {"ranges": [], "xs": set(), "initEvents": set(), "entries": 0, "sumWeights": 0.0}
+
+
+def finished(samples):
+    for d in samples.values():
+        d["xs"] = sorted(d["xs"])
+        d["initEvents"] = sorted(d["initEvents"])
+    return samples
+
+
+def build(tree, chunkSize=1000000):
+    names = columns.labels(tree, "sampleName")
+    samples = dict([(name, new()) for name in names])
+
+    iEntry = 0
+    for (iName, xs, ini, genWeight), _ in columns.chunks(tree, [columns.index("sampleName", names)] + exprs[1:], chunkSize=chunkSize):
+        update(samples, names, iName, xs, ini, genWeight, iEntry)
+        iEntry += len(iName)
+    return finished(samples)
+
+
+def get(fileName, tree):
+    samples = load(fileName)
+    if samples is None:
+        samples = build(tree)
+        save(fileName, samples)
+    return samples
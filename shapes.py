@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""shapes files written without ROOT
+
+A .npz archive (see numpy.savez) holding, for each histogram
+<dir>/<name>, the arrays <dir>/<name>/sumw, /sumw2 and /edges, and a
+JSON description /meta (titles and binning).  The histograms are added
+one at a time, so that the writer keeps none of them in memory.
+
+Usage: shapes.py in.npz [out.root]  (converts to the usual .root file; needs ROOT)"""
+
+import io
+import json
+import sys
+import zipfile
+
+import numpy
+import numpy.lib.format
+
+import hist
+import lazy_root
+
+
+class File(object):
+    """the part of TFile's interface used by make_root_files (mkdir, Close)"""
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.zip = zipfile.ZipFile(fileName, "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+
+    def mkdir(self, name):
+        return Directory(self, name)
+
+    def add(self, name, a):
+        buf = io.BytesIO()
+        numpy.lib.format.write_array(buf, numpy.asanyarray(a))
+        self.zip.writestr("%s.npy" % name, buf.getvalue())
+
+    def Close(self):
+        self.zip.close()
+
+
+class Directory(object):
+    def __init__(self, f, name):
+        self.f = f
+        self.name = name
+
+    def mkdir(self, name):
+        return Directory(self.f, "%s/%s" % (self.name, name))
+
+    def write(self, h):
+        stem = "%s/%s" % (self.name, h.name)
+        meta = {"title": h.title, "zTitle": h.zTitle}
+        if type(h.bins) is list:
+            meta["edges"] = h.bins
+        else:
+            meta["fixed"] = list(h.bins)
+
+        self.f.add(stem + "/sumw", h.sumw)
+        self.f.add(stem + "/sumw2", h.sumw2)
+        self.f.add(stem + "/edges", numpy.array(hist.edges(h.bins)))
+        self.f.add(stem + "/meta", numpy.array(json.dumps(meta)))
+
+
+def load(fileName):
+    """{"<dir>/<name>": hist.Hist} of a shapes file (.npz, or .root read with ROOT if available, else uproot)"""
+    if fileName.endswith(".root"):
+        if not lazy_root.available():
+            import rootless
+            return rootless.hists(fileName)
+        return _fromRootFile(lazy_root.load(), fileName)
+
+    npz = numpy.load(fileName)
+    out = {}
+    for key in npz.files:
+        if not key.endswith("/meta"):
+            continue
+        stem = key[:-len("/meta")]
+        meta = json.loads(str(npz[key]))
+        bins = meta["edges"] if "edges" in meta else tuple(meta["fixed"])
+        out[stem] = hist.Hist(str(stem.split("/")[-1]), str(meta["title"]), bins,
+                              npz[stem + "/sumw"], npz[stem + "/sumw2"], str(meta["zTitle"]))
+    npz.close()
+    return out
+
+
+def _fromRootFile(ROOT, fileName):
+    f = ROOT.TFile(fileName)
+    out = {}
+
+    def sweep(d, prefix):
+        for key in d.GetListOfKeys():
+            name = prefix + key.GetName()
+            if name in out:
+                continue
+            c = ROOT.TClass.GetClass(key.GetClassName())
+            if c.InheritsFrom("TDirectory"):
+                sweep(key.ReadObj(), name + "/")
+            elif c.InheritsFrom("TH1") and not c.InheritsFrom("TH2"):
+                out[name] = hist.fromTH1(key.ReadObj())
+
+    sweep(f, "")
+    f.Close()
+    return out
+
+
+def toRoot(npzName, rootName):
+    ROOT = lazy_root.load()
+    f = ROOT.TFile(rootName, "RECREATE")
+    for stem, h in sorted(load(npzName).iteritems()):
+        dirName = "/".join(stem.split("/")[:-1])
+        if dirName and not f.GetDirectory(dirName):
+            f.mkdir(dirName)
+        (f.GetDirectory(dirName) if dirName else f).WriteTObject(h.toTH1(), h.name)
+    f.Close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in [2, 3]:
+        sys.exit(__doc__.split("Usage: ")[1])
+    npzName = sys.argv[1]
+    toRoot(npzName, sys.argv[2] if len(sys.argv) == 3 else npzName.replace(".npz", ".root"))
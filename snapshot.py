@@ -0,0 +1,124 @@
+"""uncompressed columnar snapshots of eventTree, read by memory mapping
+
+A snapshot of an input file is a directory holding one <branch>.npy
+per needed branch and a manifest.json recording the source file's
+size and mtime, the number of entries, the labels of string branches
+(stored as int32 positions in that list) and the sample index (see
+sample_index.py).
+
+Columns computed from the others (e.g. the per-event weight) may be
+added with derived(); they are removed whenever the snapshot is
+rewritten."""
+
+import hashlib
+import json
+import os
+
+import numpy
+import numpy.lib.format
+
+import columns
+import sample_index
+
+
+def path(topDir, fileName):
+    absPath = os.path.abspath(fileName)
+    stem = os.path.basename(absPath).replace(".root", "")
+    return os.path.join(topDir, "%s_%s" % (stem, hashlib.sha1(absPath).hexdigest()[:8]))
+
+
+def isString(tree, branch):
+    leaf = tree.GetLeaf(branch)
+    return leaf.IsA().GetName() == "TLeafC" or leaf.GetTypeName() == "string"  # C string (not /B), or std::string (e.g. fake_trees.py)
+
+
+def write(topDir, fileName, tree, branches, samples, chunkSize=1000000):
+    d = path(topDir, fileName)
+    try:
+        os.makedirs(d)
+    except OSError as e:
+        if e.errno != 17:
+            raise e
+
+    for name in os.listdir(d):
+        if name.startswith("derived_") or name == "manifest.json":
+            os.remove(os.path.join(d, name))
+
+    nEntries = tree.GetEntries()
+    manifest = {"source": os.path.abspath(fileName),
+                "stamp": sample_index.stamp(fileName),
+                "entries": nEntries,
+                "columns": {},
+                "samples": samples,
+                }
+
+    exprs = []
+    arrays = []
+    for branch in branches:
+        column = {"file": "%s.npy" % branch}
+        if isString(tree, branch):
+            column["labels"] = columns.labels(tree, branch)
+            exprs.append(columns.index(branch, column["labels"]))
+            dtype = numpy.int32
+        else:
+            exprs.append(branch)
+            dtype = numpy.float64
+        manifest["columns"][branch] = column
+        arrays.append(numpy.lib.format.open_memmap(os.path.join(d, column["file"]), mode="w+", dtype=dtype, shape=(nEntries,)))
+
+    iEntry = 0
+    for values, _ in columns.chunks(tree, exprs, chunkSize=chunkSize):
+        for a, v in zip(arrays, values):
+            a[iEntry:iEntry + len(v)] = v
+        iEntry += len(values[0])
+
+    for a in arrays:
+        a.flush()
+    del arrays
+
+    # the manifest is written last, so that an interrupted snapshot is never used
+    f = open(os.path.join(d, "manifest.json"), "w")
+    json.dump(manifest, f, indent=1, sort_keys=True)
+    f.close()
+    return d
+
+
+def load(topDir, fileName):
+    """{"columns": {branch: memory-mapped array}, "labels": {branch: [...]}, "samples": index, "dir": ...}
+    (None if there is no up-to-date snapshot of fileName)"""
+    d = path(topDir, fileName)
+    try:
+        f = open(os.path.join(d, "manifest.json"))
+    except IOError:
+        return None
+
+    try:
+        manifest = json.load(f)
+    except ValueError:
+        return None
+    finally:
+        f.close()
+
+    if manifest["stamp"] != sample_index.stamp(fileName):
+        return None
+
+    out = {"columns": {}, "labels": {}, "samples": sample_index.decoded(manifest["samples"]), "entries": manifest["entries"], "dir": d}
+    for branch, column in manifest["columns"].iteritems():
+        branch = str(branch)
+        out["columns"][branch] = numpy.load(os.path.join(d, column["file"]), mmap_mode="r")
+        if "labels" in column:
+            out["labels"][branch] = [str(label) for label in column["labels"]]
+    return out
+
+
+def derived(snap, desc, compute):
+    """memory-mapped array computed (once per snapshot and desc) by compute(snap);
+    desc is a string determining the contents"""
+    p = os.path.join(snap["dir"], "derived_%s.npy" % hashlib.sha1(desc).hexdigest()[:16])
+    if not os.path.exists(p):
+        a = compute(snap)
+        assert len(a) == snap["entries"], (len(a), snap["entries"])
+        tmp = "%s.%d.tmp.npy" % (p[:-4], os.getpid())
+        numpy.save(tmp, a)
+        os.rename(tmp, p)  # atomic, so concurrent workers never read partial files
+    return numpy.load(p, mmap_mode="r")
@@ -0,0 +1,96 @@
+"""per-stage timing and memory of make_root_files (--profile)
+
+Each stage records its wall and CPU time, the peak resident memory of
+the process at its end, and the entries and bytes read within it (see
+count()).  Stages may be nested; counts go to every open stage.  Stages
+recorded in worker processes are returned with their results (see
+make_root_files.mapped) and merged by add(), which also adds the
+worker's counts to the stages open in the parent."""
+
+import contextlib
+import json
+import os
+import resource
+import time
+
+
+enabled = False
+records = []
+_open = []
+_counted = [0, 0]  # entries and bytes counted by this process
+
+
+def _cpu():
+    t = os.times()
+    return t[0] + t[1]
+
+
+@contextlib.contextmanager
+def stage(name, **labels):
+    if not enabled:
+        yield
+        return
+
+    rec = {"stage": name, "labels": labels, "entries": 0, "bytes": 0, "pid": os.getpid()}
+    _open.append(rec)
+    wall0 = time.time()
+    cpu0 = _cpu()
+    try:
+        yield
+    finally:
+        rec["wall"] = time.time() - wall0
+        rec["cpu"] = _cpu() - cpu0
+        rec["peakRssMB"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0  # kB on Linux
+        _open.remove(rec)
+        records.append(rec)
+
+
+def count(entries=0, nBytes=0):
+    _counted[0] += entries
+    _counted[1] += nBytes
+    for rec in _open:
+        rec["entries"] += entries
+        rec["bytes"] += nBytes
+
+
+def taken(first):
+    """records from first onwards, removed from this process"""
+    out = records[first:]
+    del records[first:]
+    return out
+
+
+def counted():
+    """(entries, bytes) counted by this process so far"""
+    return tuple(_counted)
+
+
+def add(recs, counts=(0, 0)):
+    """merge the records and counts (see counted()) of a worker process"""
+    records.extend(recs)
+    count(*counts)
+
+
+def report(fileName):
+    """write the records to fileName (JSON) and print their totals by stage and labels, slowest first"""
+    f = open(fileName, "w")
+    json.dump(records, f, indent=1, sort_keys=True)
+    f.close()
+
+    totals = {}
+    for rec in records:
+        key = (rec["stage"], " ".join(["%s=%s" % item for item in sorted(rec["labels"].iteritems())]))
+        t = totals.setdefault(key, {"n": 0, "wall": 0.0, "cpu": 0.0, "entries": 0, "bytes": 0, "peakRssMB": 0.0})
+        t["n"] += 1
+        for item in ["wall", "cpu", "entries", "bytes"]:
+            t[item] += rec[item]
+        t["peakRssMB"] = max(t["peakRssMB"], rec["peakRssMB"])
+
+    n = max([len("%s  %s" % k) for k in totals.keys()] + [len("stage")])
+    header = "  ".join(["stage".ljust(n), "%4s" % "n", "%9s" % "wall (s)", "%9s" % "cpu (s)", "%11s" % "entries", "%10s" % "MB read", "%11s" % "peak RSS MB"])
+    print header
+    print "-" * len(header)
+    for key, t in sorted(totals.iteritems(), key=lambda x: -x[1]["wall"]):
+        print "  ".join([("%s  %s" % key).ljust(n), "%4d" % t["n"], "%9.2f" % t["wall"], "%9.2f" % t["cpu"],
+                         "%11d" % t["entries"], "%10.1f" % (t["bytes"] / 1024.0**2), "%11.1f" % t["peakRssMB"]])
+    print "(report in %s)" % fileName